@@ -0,0 +1,35 @@
+# Crash-safe writes of on-disk caches, i.e. directories of .npy files whose
+# JSON metadata file marks them valid. The metadata is removed before any data
+# is written and written last, so an interrupted write leaves the cache
+# invalid (and rebuilt on next use) instead of mixing old and new files:
+#   with atomic.cache_write(meta_path, {'hash': digest}) as meta:
+#     atomic.save_npy(os.path.join(cache_dir, 'slope.npy'), slope)
+#     meta['rasters'] = ['slope']
+
+import contextlib
+import json
+import os
+
+import numpy as np
+
+
+# Invalidates the cache marked by `meta_path`, runs the body, then atomically
+# writes `meta` (as changed by the body) to `meta_path`. Nothing is written if
+# the body raises.
+@contextlib.contextmanager
+def cache_write(meta_path, meta):
+    os.makedirs(os.path.dirname(meta_path) or '.', exist_ok=True)
+    if os.path.exists(meta_path): os.remove(meta_path)
+    yield meta
+    tmp_path = meta_path + '.tmp'
+    with open(tmp_path, 'w') as meta_file:
+        json.dump(meta, meta_file, indent=2)
+    os.replace(tmp_path, meta_path)
+
+
+# Saves `array` to the .npy file `path` through a temporary file, so `path`
+# never holds a partial array.
+def save_npy(path, array):
+    tmp_path = os.path.splitext(path)[0] + '.tmp.npy'
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
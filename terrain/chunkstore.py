@@ -0,0 +1,213 @@
+# Chunked multi-resolution storage for terrain rasters. A store is a directory
+# with one subdirectory per channel ('height', 'land_mask', ...), each holding
+# fixed-size tiles for every level of a 2x downsampled pyramid:
+#   <root>/chunkstore.json
+#   <root>/<channel>/<level>/<row>_<col>.npy
+#   <root>/arrays/<name>.npy      (non-raster arrays, e.g. the river graph)
+# Float channels can be quantized to uint16 with a per-channel scale and
+# offset. Reading a window at any level only loads the tiles it overlaps:
+#   chunkstore.write('river_network_42_1024', result, quantize=('height',))
+#   store = chunkstore.ChunkStore('river_network_42_1024')
+#   preview = store.read('height', level=2)
+#   detail = store.read('height', y_range=(256, 512), x_range=(0, 256))
+# `store.view('height', level)` wraps a channel as a read-only array-like that
+# can be sliced like a memory-mapped heightmap.
+
+import json
+import os
+
+import numpy as np
+
+import atomic
+
+
+_QUANTIZED_MAX = np.iinfo(np.uint16).max
+
+# The metadata file, named so other caches with a meta.json are not mistaken
+# for stores.
+META_NAME = 'chunkstore.json'
+
+
+# Returns whether `path` is a chunk store directory.
+def is_store(path):
+    meta_path = os.path.join(path, META_NAME)
+    if not os.path.isfile(meta_path):
+        return False
+    with open(meta_path) as meta_file:
+        meta = json.load(meta_file)
+    return isinstance(meta, dict) and 'chunk' in meta and 'channels' in meta
+
+
+# Returns the number of pyramid levels until one tile covers the whole raster.
+def num_levels(shape, chunk):
+    return 1 + max(0, int(np.ceil(np.log2(max(max(shape) / chunk, 1)))))
+
+
+# Returns `a` downsampled by 2 in both axes. Float rasters are averaged over
+# 2x2 blocks (odd edges are padded), others are subsampled.
+def _downsample(a):
+    if a.dtype.kind != 'f':
+        return a[::2, ::2]
+    a = np.pad(a, [(0, a.shape[0] % 2), (0, a.shape[1] % 2)], mode='edge')
+    return 0.25 * (a[0::2, 0::2] + a[1::2, 0::2] + a[0::2, 1::2] + a[1::2, 1::2])
+
+
+def _tile_path(root, channel, level, i, j):
+    return os.path.join(root, channel, str(level), '%d_%d.npy' % (i, j))
+
+
+# Writes the rasters of `arrays`, i.e. the 2D arrays with the shape of
+# `arrays['height']`, as chunked channels of `chunk` x `chunk` tiles with
+# `levels` pyramid levels (by default down to a single tile). Other arrays are
+# written as plain .npy files. Float channels named in `quantize` are stored
+# as uint16, the others as float32.
+def write(root, arrays, chunk=256, levels=None, quantize=('height',)):
+    shape = np.shape(arrays['height'])
+    rasters = {key: np.asarray(a) for (key, a) in arrays.items()
+               if np.ndim(a) == 2 and np.shape(a) == shape}
+    if levels is None:
+        levels = num_levels(shape, chunk)
+
+    meta = {'shape': list(shape), 'chunk': chunk, 'levels': levels,
+            'channels': {}, 'arrays': []}
+    with atomic.cache_write(os.path.join(root, META_NAME), meta):
+        for (key, raster) in rasters.items():
+            channel = {'dtype': raster.dtype.str, 'scale': None,
+                       'offset': None}
+            if raster.dtype.kind == 'f':
+                raster = raster.astype(np.float32)
+                channel['dtype'] = np.dtype(np.float32).str
+                if key in quantize:
+                    (low, high) = (float(raster.min()), float(raster.max()))
+                    channel.update(dtype=np.dtype(np.uint16).str, offset=low,
+                                   scale=(high - low) / _QUANTIZED_MAX or 1.0)
+
+            level_shapes = []
+            for level in range(levels):
+                if level > 0: raster = _downsample(raster)
+                level_shapes.append(list(raster.shape))
+                stored = raster
+                if channel['scale'] is not None:
+                    stored = np.round((raster - channel['offset'])
+                                      / channel['scale'])
+                    stored = np.clip(stored, 0, _QUANTIZED_MAX).astype(
+                        np.uint16)
+                os.makedirs(os.path.join(root, key, str(level)), exist_ok=True)
+                for i in range(0, raster.shape[0], chunk):
+                    for j in range(0, raster.shape[1], chunk):
+                        atomic.save_npy(_tile_path(root, key, level,
+                                                   i // chunk, j // chunk),
+                                        stored[i:i + chunk, j:j + chunk])
+            channel['level_shapes'] = level_shapes
+            meta['channels'][key] = channel
+
+        os.makedirs(os.path.join(root, 'arrays'), exist_ok=True)
+        for (key, a) in arrays.items():
+            if key not in rasters:
+                atomic.save_npy(os.path.join(root, 'arrays', key + '.npy'), a)
+                meta['arrays'].append(key)
+
+
+# Read access to a chunk store written by `write`.
+class ChunkStore:
+    def __init__(self, root):
+        self.root = root
+        with open(os.path.join(root, META_NAME)) as meta_file:
+            self.meta = json.load(meta_file)
+        self.chunk = self.meta['chunk']
+        self.levels = self.meta['levels']
+        self.channels = tuple(self.meta['channels'])
+
+    # Returns the shape of `channel` at pyramid `level`.
+    def shape(self, channel, level=0):
+        return tuple(self._channel(channel)['level_shapes'][level])
+
+    # Reads the window [y_range) x [x_range) of `channel` at pyramid `level`,
+    # in that level's cells, loading only the overlapping tiles. Quantized
+    # channels are returned as float32.
+    def read(self, channel, y_range=None, x_range=None, level=0):
+        info = self._channel(channel)
+        (rows, cols) = self.shape(channel, level)
+        (y0, y1) = y_range or (0, rows)
+        (x0, x1) = x_range or (0, cols)
+        (y0, y1, x0, x1) = (max(y0, 0), min(y1, rows), max(x0, 0), min(x1, cols))
+
+        window = np.empty((max(y1 - y0, 0), max(x1 - x0, 0)),
+                          dtype=np.dtype(info['dtype']))
+        c = self.chunk
+        for i in range(y0 // c, -(-y1 // c)):
+            for j in range(x0 // c, -(-x1 // c)):
+                tile = np.load(_tile_path(self.root, channel, level, i, j),
+                               mmap_mode='r')
+                (ty0, tx0) = (max(y0, i * c), max(x0, j * c))
+                (ty1, tx1) = (min(y1, (i + 1) * c), min(x1, (j + 1) * c))
+                window[ty0 - y0:ty1 - y0, tx0 - x0:tx1 - x0] = (
+                    tile[ty0 - i * c:ty1 - i * c, tx0 - j * c:tx1 - j * c])
+
+        if info['scale'] is not None:
+            window = window.astype(np.float32) * info['scale'] + info['offset']
+        return window
+
+    # Returns the non-raster array `key`.
+    def array(self, key):
+        if key not in self.meta['arrays']:
+            raise KeyError(f'The chunk store has no {key!r} array.')
+        return np.load(os.path.join(self.root, 'arrays', key + '.npy'))
+
+    # Returns all channels at full resolution and all other arrays, like the
+    # contents of the .npz files written by `river_network`.
+    def load_all(self):
+        result = {key: self.read(key) for key in self.channels}
+        result.update((key, self.array(key)) for key in self.meta['arrays'])
+        return result
+
+    # Returns `channel` at pyramid `level` as an array-like with a `shape`
+    # that reads only the needed tiles when sliced.
+    def view(self, channel, level=0):
+        return ChannelView(self, channel, level)
+
+    def _channel(self, channel):
+        if channel not in self.meta['channels']:
+            raise KeyError(f'The chunk store has no {channel!r} channel, '
+                           f'expected one of {self.channels}.')
+        return self.meta['channels'][channel]
+
+
+# One channel and level of a `ChunkStore`, sliceable like a 2D array:
+#   view[100:200, ::4]
+class ChannelView:
+    def __init__(self, store, channel, level=0):
+        self.store = store
+        self.channel = channel
+        self.level = level
+        self.shape = store.shape(channel, level)
+        info = store._channel(channel)
+        self.dtype = (np.dtype(np.float32) if info['scale'] is not None
+                      else np.dtype(info['dtype']))
+        self.ndim = 2
+        self.size = self.shape[0] * self.shape[1]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple): key = (key,)
+        key = key + (slice(None),) * (2 - len(key))
+        ranges = []
+        steps = []
+        for (k, n) in zip(key, self.shape):
+            if isinstance(k, (int, np.integer)):
+                k = slice(k % n, k % n + 1)
+            (start, stop, step) = k.indices(n)
+            if step < 1:
+                raise IndexError('ChannelView only supports positive steps.')
+            ranges.append((start, max(start, stop)))
+            steps.append(step)
+        window = self.store.read(self.channel, ranges[0], ranges[1], self.level)
+        window = window[::steps[0], ::steps[1]]
+        return window[tuple(0 if isinstance(k, (int, np.integer)) else
+                            slice(None) for k in key)]
+
+    def __array__(self, dtype=None, copy=None):
+        window = self[:, :]
+        return window if dtype is None else window.astype(dtype)
+
+    def __len__(self):
+        return self.shape[0]
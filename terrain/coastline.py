@@ -0,0 +1,77 @@
+# Coastlines straight from a heightmap. The land/water boundary is the contour
+# of `height` at the water level, traced with marching squares
+# (`skimage.measure.find_contours`), so no mesh or ray casting is needed.
+# Contours are mapped to world space with the transform of the terrain object
+# built by `general.get_landscape` (vertex (col, -row, height), scaled by
+# (scale_xy, scale_xy, scale_z), then moved to `location`):
+#   level = water_level(water_offset, scale_z)
+#   coasts = coastline.coastlines(height, level, location, scale_xy, scale_z,
+#                                 spacing=50.0)
+#   coasts[0]['points'], coasts[0]['length'], coasts[0]['samples']
+
+import numpy as np
+import skimage.measure
+
+
+# Returns the heightmap value at which the terrain object, placed at
+# z = `water_offset` and scaled by `scale_z`, meets the water plane at
+# `water_z` (`general.get_ocean` puts it at 0).
+def water_level(water_offset, scale_z, water_z=0.0):
+    return (water_z - water_offset) / scale_z
+
+
+# Returns the contours of `height` at `level` as a list of (n, 2) arrays of
+# (row, col) positions. Closed contours end where they start.
+def extract(height, level):
+    return skimage.measure.find_contours(np.asarray(height, dtype=np.float64),
+                                         level)
+
+
+# Maps (row, col) contour positions at heightmap value `level` to (n, 3)
+# world-space points.
+def to_world(contour, level, location=(0.0, 0.0, 0.0), scale_xy=1.0,
+             scale_z=1.0):
+    points = np.empty((len(contour), 3))
+    points[:, 0] = location[0] + contour[:, 1] * scale_xy
+    points[:, 1] = location[1] - contour[:, 0] * scale_xy
+    points[:, 2] = location[2] + level * scale_z
+    return points
+
+
+# Returns the total length of a polyline.
+def polyline_length(points):
+    return float(np.linalg.norm(np.diff(points, axis=0), axis=1).sum())
+
+
+# Returns points evenly spaced by `spacing` along a polyline, starting at its
+# first point.
+def resample(points, spacing):
+    distance = np.concatenate(
+        [[0.0], np.cumsum(np.linalg.norm(np.diff(points, axis=0), axis=1))])
+    targets = np.arange(0.0, distance[-1], spacing)
+    return np.stack([np.interp(targets, distance, points[:, k])
+                     for k in range(points.shape[1])], axis=1)
+
+
+# Extracts the coastlines of `height` at `level` in world space. Returns a
+# list of dicts with the polyline `points`, its `length`, whether it is
+# `closed` (islands and lakes) or runs off the map, and `samples` spaced
+# `spacing` apart (if given), longest first. Coastlines shorter than
+# `min_length` are dropped.
+def coastlines(height, level, location=(0.0, 0.0, 0.0), scale_xy=1.0,
+               scale_z=1.0, spacing=None, min_length=0.0):
+    result = []
+    for contour in extract(height, level):
+        points = to_world(contour, level, location, scale_xy, scale_z)
+        length = polyline_length(points)
+        if length < min_length: continue
+        coast = {
+            'points': points,
+            'length': length,
+            'closed': bool(np.all(contour[0] == contour[-1])),
+        }
+        if spacing is not None:
+            coast['samples'] = resample(points, spacing)
+        result.append(coast)
+    result.sort(key=lambda coast: -coast['length'])
+    return result
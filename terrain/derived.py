@@ -0,0 +1,158 @@
+# Derived terrain rasters (slope, aspect, curvature and flow accumulation).
+# These are computed once per heightmap, cached next to its .npz file and read
+# back lazily as memory maps. The cache is rebuilt whenever the hash of the
+# height data changes.
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import atomic
+
+
+RASTERS = ('slope', 'aspect', 'curvature', 'flow')
+
+# The 8 neighbor offsets as (dy, dx).
+_NEIGHBORS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0),
+              (1, 1)]
+
+
+# Returns a hex digest that identifies the contents of `height`.
+def height_hash(height):
+    height = np.ascontiguousarray(height)
+    h = hashlib.sha1()
+    h.update(str((height.shape, height.dtype.str)).encode())
+    h.update(height.data)
+    return h.hexdigest()
+
+
+# Returns the slope (rise over run) and aspect of `height`. The aspect is the
+# angle of the downhill direction in array coordinates, i.e. measured from the
+# column axis towards the row axis.
+def slope_aspect(height, cell_width=1.0):
+    [dy, dx] = np.gradient(height, cell_width)
+    return (np.hypot(dx, dy), np.arctan2(-dy, -dx))
+
+
+# Returns the curvature of `height` as the 5-point laplacian. Positive values
+# are concave (valleys), negative values convex (ridges).
+def curvature(height, cell_width=1.0):
+    p = np.pad(height, 1, mode='edge')
+    laplacian = (p[:-2, 1:-1] + p[2:, 1:-1] + p[1:-1, :-2] + p[1:-1, 2:]
+                 - 4 * height)
+    return laplacian / cell_width ** 2
+
+
+# Returns the index of the steepest downhill neighbor (D8) of each cell, in
+# flattened coordinates. Cells without a lower neighbor are their own receiver.
+def d8_receivers(height):
+    rows, cols = height.shape
+    padded = np.pad(height, 1, mode='constant', constant_values=np.inf)
+    receiver = np.arange(rows * cols).reshape(rows, cols)
+    [row, col] = np.indices(height.shape)
+    steepest = np.zeros(height.shape)
+    for (dy, dx) in _NEIGHBORS:
+        neighbor = padded[1 + dy:1 + dy + rows, 1 + dx:1 + dx + cols]
+        drop = (height - neighbor) / np.hypot(dy, dx)
+        steeper = drop > steepest
+        steepest[steeper] = drop[steeper]
+        receiver[steeper] = ((row[steeper] + dy) * cols + col[steeper] + dx)
+    return receiver.ravel()
+
+
+# Returns the number of cells draining through each cell (including itself),
+# following D8 receivers. Cells are processed in waves from the ridges down,
+# so each wave is a handful of array operations.
+def flow_accumulation(height):
+    receiver = d8_receivers(height)
+    num_cells = receiver.size
+    is_sink = receiver == np.arange(num_cells)
+    donors = np.bincount(receiver[~is_sink], minlength=num_cells)
+    accumulation = np.ones(num_cells)
+
+    front = np.flatnonzero(donors == 0)
+    while front.size > 0:
+        front = front[~is_sink[front]]
+        downstream = receiver[front]
+        np.add.at(accumulation, downstream, accumulation[front])
+        np.subtract.at(donors, downstream, 1)
+        front = np.unique(downstream[donors[downstream] == 0])
+    return accumulation.reshape(height.shape)
+
+
+# Computes the derived `rasters` of `height` in memory (all by default).
+def compute_derived(height, cell_width=1.0, rasters=RASTERS):
+    result = {}
+    if 'slope' in rasters or 'aspect' in rasters:
+        (slope, aspect) = slope_aspect(height, cell_width)
+        result.update(slope=slope.astype(np.float32),
+                      aspect=aspect.astype(np.float32))
+    if 'curvature' in rasters:
+        result['curvature'] = curvature(height, cell_width).astype(np.float32)
+    if 'flow' in rasters:
+        result['flow'] = flow_accumulation(height).astype(np.float32)
+    return {key: result[key] for key in rasters}
+
+
+# Lazy, cached derived rasters of the heightmap stored in `npz_path`. Rasters
+# are written to `<npz name>_derived/` and read back as read-only memory maps:
+#   derived = DerivedRasters('river_network.npz')
+#   slope = derived['slope']
+# Pass `height` if it is already in memory to avoid reading it from disk.
+class DerivedRasters:
+    def __init__(self, npz_path, key='height', cell_width=1.0, cache_dir=None,
+                 height=None):
+        self.npz_path = npz_path
+        self.key = key
+        self.cell_width = cell_width
+        self.cache_dir = cache_dir or os.path.splitext(npz_path)[0] + '_derived'
+        self._height = height
+        self._rasters = {}
+        self._checked = False
+
+    def __getitem__(self, name):
+        if name not in RASTERS:
+            raise KeyError(f'Unknown derived raster {name!r}, expected one of '
+                           f'{RASTERS}.')
+        if name not in self._rasters:
+            self.ensure()
+            self._rasters[name] = np.load(self._raster_path(name), mmap_mode='r')
+        return self._rasters[name]
+
+    def keys(self):
+        return RASTERS
+
+    # Recomputes the cache if it is missing or was built from different height
+    # data. Returns True if the cache was rebuilt.
+    def ensure(self):
+        if self._checked: return False
+        self._checked = True
+
+        height = self._height
+        if height is None:
+            with np.load(self.npz_path) as data:
+                height = data[self.key]
+        meta = {'hash': height_hash(height), 'cell_width': self.cell_width}
+        if self._read_meta() == meta:
+            return False
+
+        print(f'Computing derived rasters for {self.npz_path}...')
+        meta_path = os.path.join(self.cache_dir, 'meta.json')
+        with atomic.cache_write(meta_path, meta):
+            rasters = compute_derived(height, self.cell_width)
+            for (name, raster) in rasters.items():
+                atomic.save_npy(self._raster_path(name), raster)
+        self._rasters = {}
+        return True
+
+    def _raster_path(self, name):
+        return os.path.join(self.cache_dir, name + '.npy')
+
+    def _read_meta(self):
+        try:
+            with open(os.path.join(self.cache_dir, 'meta.json')) as meta_file:
+                return json.load(meta_file)
+        except (OSError, ValueError):
+            return None
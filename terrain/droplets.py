@@ -0,0 +1,159 @@
+# Particle-based hydraulic erosion. Large batches of raindrops are simulated
+# at once as arrays of position, direction, speed, water and sediment. Each
+# droplet follows the bilinear gradient of the terrain, eroding where it speeds
+# up downhill and depositing where it slows down or its capacity drops. Terrain
+# changes are scattered to the 4 cells around each droplet with `np.add.at`,
+# and split between droplets that share a cell within the same step.
+# Based on the particle model in H. T. Beyer, "Implementation of a method for
+# hydraulic erosion" (2015).
+
+import numpy as np
+
+
+# Heights are multiplied by `height_scale` during the simulation, so that the
+# constants below work for heightmaps normalized to [0, 1].
+DEFAULT_PARAMS = {
+    'height_scale': 64.0,
+    'inertia': 0.05,
+    'sediment_capacity_factor': 4.0,
+    'min_sediment_capacity': 0.01,
+    'erode_rate': 0.3,
+    'deposit_rate': 0.3,
+    'evaporation_rate': 0.01,
+    'gravity': 4.0,
+    'max_lifetime': 30,
+    'initial_water': 1.0,
+    'initial_speed': 1.0,
+}
+
+
+# Returns the flat index of the top-left cell around each (x, y) position, the
+# offsets within that cell, and the bilinear height and gradient there.
+def _sample(terrain, x, y):
+    cols = terrain.shape[1]
+    flat = terrain.reshape(-1)
+    ix = x.astype(np.intp)
+    iy = y.astype(np.intp)
+    fx = x - ix
+    fy = y - iy
+    index = iy * cols + ix
+
+    h00 = flat[index]
+    h10 = flat[index + 1]
+    h01 = flat[index + cols]
+    h11 = flat[index + cols + 1]
+    gx = (h10 - h00) * (1 - fy) + (h11 - h01) * fy
+    gy = (h01 - h00) * (1 - fx) + (h11 - h10) * fx
+    height = (h00 * (1 - fx) * (1 - fy) + h10 * fx * (1 - fy) +
+              h01 * (1 - fx) * fy + h11 * fx * fy)
+    return (index, fx, fy, height, gx, gy)
+
+
+# Adds `amount` to the terrain at each droplet, spread over the 4 surrounding
+# cells with bilinear weights.
+def _scatter(terrain, index, fx, fy, amount):
+    cols = terrain.shape[1]
+    np.add.at(terrain.reshape(-1),
+              np.concatenate([index, index + 1, index + cols, index + cols + 1]),
+              np.concatenate([amount * (1 - fx) * (1 - fy),
+                              amount * fx * (1 - fy),
+                              amount * (1 - fx) * fy,
+                              amount * fx * fy]))
+
+
+# Simulates `num_droplets` droplets in parallel on `terrain`, in place.
+def _simulate_batch(terrain, num_droplets, p, rng):
+    rows, cols = terrain.shape
+    x = rng.random(num_droplets) * (cols - 1)
+    y = rng.random(num_droplets) * (rows - 1)
+    dx = np.zeros(num_droplets)
+    dy = np.zeros(num_droplets)
+    speed = np.full(num_droplets, float(p['initial_speed']))
+    water = np.full(num_droplets, float(p['initial_water']))
+    sediment = np.zeros(num_droplets)
+
+    for _ in range(int(p['max_lifetime'])):
+        (index, fx, fy, height, gx, gy) = _sample(terrain, x, y)
+
+        # Blend the previous direction with the downhill direction, picking a
+        # random direction on flat ground.
+        dx = dx * p['inertia'] - gx * (1 - p['inertia'])
+        dy = dy * p['inertia'] - gy * (1 - p['inertia'])
+        length = np.hypot(dx, dy)
+        flat = length < 1e-12
+        if flat.any():
+            angle = 2 * np.pi * rng.random(np.count_nonzero(flat))
+            (dx[flat], dy[flat], length[flat]) = (np.cos(angle), np.sin(angle),
+                                                  1.0)
+        dx /= length
+        dy /= length
+        new_x = x + dx
+        new_y = y + dy
+
+        # Droplets that leave the map are dropped, together with their sediment.
+        alive = ((new_x >= 0) & (new_x < cols - 1) &
+                 (new_y >= 0) & (new_y < rows - 1) & (water > 1e-6))
+        if not alive.all():
+            (x, y, new_x, new_y, dx, dy, speed, water, sediment, index, fx, fy,
+             height) = (a[alive] for a in (
+                x, y, new_x, new_y, dx, dy, speed, water, sediment, index, fx,
+                fy, height))
+            if len(x) == 0: return
+
+        new_height = _sample(terrain, new_x, new_y)[3]
+        height_delta = new_height - height
+
+        # Uphill, droplets fill the pit behind them. Otherwise they deposit or
+        # erode towards their carrying capacity, never digging deeper than the
+        # drop to the next position.
+        capacity = np.maximum(-height_delta * speed * water *
+                              p['sediment_capacity_factor'],
+                              p['min_sediment_capacity'])
+        change = np.where(
+            sediment > capacity,
+            (sediment - capacity) * p['deposit_rate'],
+            -np.minimum((capacity - sediment) * p['erode_rate'],
+                        -height_delta))
+        uphill = height_delta > 0
+        change[uphill] = np.minimum(height_delta[uphill], sediment[uphill])
+
+        # Droplets sharing a cell split its change between them, so that the
+        # batch as a whole respects the per-droplet limits above.
+        (_, inverse, counts) = np.unique(index, return_inverse=True,
+                                         return_counts=True)
+        change /= counts[inverse]
+        sediment -= change
+        _scatter(terrain, index, fx, fy, change)
+
+        speed = np.sqrt(np.maximum(speed ** 2 - height_delta * p['gravity'],
+                                   0.0))
+        water *= 1 - p['evaporation_rate']
+        (x, y) = (new_x, new_y)
+
+
+# Erodes `heightmap` with `num_droplets` droplets (by default one per cell),
+# simulated in batches of `batch_size`, and yields a snapshot dict every
+# `every` batches and after the last one. Like `simulation.erode`, snapshots
+# hold a copy of the `terrain` and the number of completed `iteration`s (here,
+# batches):
+#   for snapshot in droplets.erode(height, every=4):
+#     preview(snapshot['terrain'])
+def erode(heightmap, params=None, num_droplets=None, batch_size=65536,
+          every=1, seed=None):
+    p = dict(DEFAULT_PARAMS, **(params or {}))
+    rng = np.random.default_rng(seed)
+    terrain = np.array(heightmap, dtype=np.float64) * p['height_scale']
+    if num_droplets is None:
+        num_droplets = terrain.size
+    num_batches = max(1, -(-num_droplets // batch_size))
+
+    for i in range(num_batches):
+        count = min(batch_size, num_droplets - i * batch_size)
+        _simulate_batch(terrain, count, p, rng)
+        if (i + 1) % every == 0 or i + 1 == num_batches:
+            yield {
+                'terrain': (terrain / p['height_scale']).astype(np.float32),
+                'iteration': i + 1,
+                'metrics': {'droplets': min(num_droplets, (i + 1) * batch_size)},
+                'converged': False,
+            }
@@ -0,0 +1,211 @@
+# Headless terrain mesh export. Writes a heightmap as a grid mesh to binary
+# PLY or glTF (.glb) with plain numpy, so assets can be produced without
+# Blender. Vertices and faces are generated and written `block_rows` grid rows
+# at a time, so memory use does not grow with the grid size beyond the
+# heightmap itself (which is memory-mapped when read from a .npy file):
+#   export.export('river_network.npz', 'terrain.glb', scale_xy=8, scale_z=512)
+#   export.export('river_network.npz', 'terrain.ply', stride=4, tiles=(2, 2))
+# PLY meshes use the Blender convention of `utils/blender_io.py` (x = column,
+# y = -row, z = height, one quad per cell). glTF is Y-up, so there x = column,
+# y = height, z = row, with two triangles per cell.
+
+import json
+import os
+import struct
+import sys
+
+import numpy as np
+
+
+FORMATS = ('.ply', '.glb')
+
+_GLTF_FLOAT = 5126
+_GLTF_UNSIGNED_INT = 5125
+_GLTF_ARRAY_BUFFER = 34962
+_GLTF_ELEMENT_ARRAY_BUFFER = 34963
+
+
+# Returns the `key` array of a .npz or .npy file. .npy files are
+# memory-mapped.
+def load_height(path, key='height'):
+    if path.endswith('.npz'):
+        with np.load(path) as data:
+            return data[key]
+    return np.load(path, mmap_mode='r')
+
+
+# Returns the vertex block of grid rows [`start`, `end`) of `height` as (n, 3)
+# float32, with the columns of `axes` taking x, -row and height. `origin` is
+# the (row, col) of the first grid point in the full heightmap.
+def _vertex_block(height, start, end, scale_xy, scale_z, axes, origin):
+    block = np.asarray(height[start:end], dtype=np.float32)
+    (rows, cols) = block.shape
+    verts = np.empty((rows, cols, 3), dtype=np.float32)
+    verts[:, :, axes[0]] = (origin[1] + np.arange(cols)) * scale_xy
+    verts[:, :, axes[1]] = (-(origin[0] + np.arange(start, end))[:, None]
+                            * scale_xy)
+    verts[:, :, axes[2]] = block * scale_z
+    return verts.reshape(-1, 3)
+
+
+# Returns the indices of the 4 corners (v1, v2, v3, v4) of each cell in grid
+# rows [`start`, `end`): top left, top right, bottom right and bottom left.
+def _cell_corners(start, end, cols):
+    v1 = (np.arange(start, end)[:, None] * cols + np.arange(cols - 1)).ravel()
+    return (v1, v1 + 1, v1 + cols + 1, v1 + cols)
+
+
+# Writes `height` as a binary little-endian PLY mesh with one quad per cell.
+# `origin` is the (row, col) of `height` in the full heightmap, for tiles.
+def export_ply(path, height, scale_xy=1.0, scale_z=1.0, origin=(0, 0),
+               block_rows=256):
+    (rows, cols) = height.shape
+    header = '\n'.join([
+        'ply',
+        'format binary_little_endian 1.0',
+        'element vertex %d' % (rows * cols),
+        'property float x',
+        'property float y',
+        'property float z',
+        'element face %d' % ((rows - 1) * (cols - 1)),
+        'property list uchar int vertex_indices',
+        'end_header',
+    ]) + '\n'
+    face_dtype = np.dtype([('count', 'u1'), ('indices', '<i4', 4)])
+
+    with open(path, 'wb') as f:
+        f.write(header.encode('ascii'))
+        for start in range(0, rows, block_rows):
+            end = min(start + block_rows, rows)
+            f.write(_vertex_block(height, start, end, scale_xy, scale_z,
+                                  (0, 1, 2), origin).astype('<f4').tobytes())
+        for start in range(0, rows - 1, block_rows):
+            end = min(start + block_rows, rows - 1)
+            (v1, v2, v3, v4) = _cell_corners(start, end, cols)
+            faces = np.empty(len(v1), dtype=face_dtype)
+            faces['count'] = 4
+            # Counter-clockwise seen from +z, so the normals point up.
+            faces['indices'] = np.stack([v1, v4, v3, v2], axis=1)
+            f.write(faces.tobytes())
+
+
+# Writes `height` as a binary glTF 2.0 (.glb) mesh with two triangles per
+# cell. The buffer layout is known from the grid size, so the JSON header is
+# written first and the binary data streamed after it. `origin` is as in
+# `export_ply`.
+def export_glb(path, height, scale_xy=1.0, scale_z=1.0, origin=(0, 0),
+               block_rows=256):
+    (rows, cols) = height.shape
+    num_verts = rows * cols
+    num_indices = (rows - 1) * (cols - 1) * 6
+    positions_size = num_verts * 12
+    indices_size = num_indices * 4
+    if 28 + positions_size + indices_size >= 2 ** 32:
+        raise ValueError('Grid of %dx%d is too large for a single .glb file, '
+                         'use tiles or a stride.' % (rows, cols))
+
+    # Accessors need the position bounds; heights take one pass over the map.
+    (low, high) = (float('inf'), float('-inf'))
+    for start in range(0, rows, block_rows):
+        block = np.asarray(height[start:start + block_rows], dtype=np.float32)
+        (low, high) = (min(low, float(block.min())), max(high, float(block.max())))
+    (low, high) = sorted([low * scale_z, high * scale_z])
+
+    gltf = {
+        'asset': {'version': '2.0', 'generator': 'terrain/export.py'},
+        'scene': 0,
+        'scenes': [{'nodes': [0]}],
+        'nodes': [{'mesh': 0, 'name': 'terrain'}],
+        'meshes': [{'primitives': [{'attributes': {'POSITION': 0},
+                                    'indices': 1}]}],
+        'buffers': [{'byteLength': positions_size + indices_size}],
+        'bufferViews': [
+            {'buffer': 0, 'byteOffset': 0, 'byteLength': positions_size,
+             'target': _GLTF_ARRAY_BUFFER},
+            {'buffer': 0, 'byteOffset': positions_size,
+             'byteLength': indices_size,
+             'target': _GLTF_ELEMENT_ARRAY_BUFFER},
+        ],
+        'accessors': [
+            {'bufferView': 0, 'componentType': _GLTF_FLOAT,
+             'count': num_verts, 'type': 'VEC3',
+             'min': [origin[1] * scale_xy, low, origin[0] * scale_xy],
+             'max': [(origin[1] + cols - 1) * scale_xy, high,
+                     (origin[0] + rows - 1) * scale_xy]},
+            {'bufferView': 1, 'componentType': _GLTF_UNSIGNED_INT,
+             'count': num_indices, 'type': 'SCALAR'},
+        ],
+    }
+    header = json.dumps(gltf, separators=(',', ':')).encode()
+    header += b' ' * (-len(header) % 4)
+    total = 12 + 8 + len(header) + 8 + positions_size + indices_size
+
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<4sII', b'glTF', 2, total))
+        f.write(struct.pack('<I4s', len(header), b'JSON'))
+        f.write(header)
+        f.write(struct.pack('<I4s', positions_size + indices_size, b'BIN\0'))
+        for start in range(0, rows, block_rows):
+            end = min(start + block_rows, rows)
+            verts = _vertex_block(height, start, end, scale_xy, scale_z,
+                                  (0, 2, 1), origin)
+            # The row axis points along +z, towards the viewer.
+            verts[:, 2] *= -1
+            f.write(verts.astype('<f4').tobytes())
+        for start in range(0, rows - 1, block_rows):
+            end = min(start + block_rows, rows - 1)
+            (v1, v2, v3, v4) = _cell_corners(start, end, cols)
+            # Counter-clockwise seen from +y.
+            triangles = np.stack([v1, v4, v3, v1, v3, v2], axis=1)
+            f.write(triangles.astype('<u4').tobytes())
+
+
+# Returns `num_tiles` + 1 tile bounds over `n` grid points. Neighboring tiles
+# share the seam row or column at each bound.
+def _tile_bounds(n, num_tiles):
+    return np.linspace(0, n - 1, num_tiles + 1).round().astype(int)
+
+
+# Exports the heightmap in `source` (a .npz or .npy path, or an array) to
+# `path`, in the format given by its extension. `stride` decimates the grid.
+# With `tiles` = (rows, cols), one file per tile is written instead, named
+# '<name>_<row>_<col><ext>' and placed where it lies in the full map.
+# Returns the written paths.
+def export(source, path, scale_xy=1.0, scale_z=1.0, stride=1, tiles=None,
+           key='height', block_rows=256):
+    (name, ext) = os.path.splitext(path)
+    if ext not in FORMATS:
+        raise ValueError(f'Unknown mesh format {ext!r}, expected one of '
+                         f'{FORMATS}.')
+    writer = export_ply if ext == '.ply' else export_glb
+    height = load_height(source, key) if isinstance(source, str) else source
+    height = height[::stride, ::stride]
+    scale_xy *= stride
+
+    if tiles is None:
+        writer(path, height, scale_xy, scale_z, block_rows=block_rows)
+        return [path]
+
+    paths = []
+    row_bounds = _tile_bounds(height.shape[0], tiles[0])
+    col_bounds = _tile_bounds(height.shape[1], tiles[1])
+    for i in range(tiles[0]):
+        for j in range(tiles[1]):
+            tile_path = f'{name}_{i}_{j}{ext}'
+            writer(tile_path, height[row_bounds[i]:row_bounds[i + 1] + 1,
+                                     col_bounds[j]:col_bounds[j + 1] + 1],
+                   scale_xy, scale_z, (row_bounds[i], col_bounds[j]),
+                   block_rows)
+            paths.append(tile_path)
+    return paths
+
+
+# Usage: python export.py river_network.npz terrain.glb [stride]
+def main(argv):
+    stride = int(argv[3]) if len(argv) > 3 else 1
+    for path in export(argv[1], argv[2], stride=stride):
+        print('Wrote', path)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -2,6 +2,7 @@
 import bpy
 import os
 import importlib
+import numpy as np
 
 #import sys
 #current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -12,6 +13,10 @@ import importlib
 
 import river_network
 importlib.reload(river_network)
+import pipeline
+importlib.reload(pipeline)
+import coastline
+importlib.reload(coastline)
 
 
 #sys.path.append("C:/Users/jlbuc/my_python/repos/blender_architecture/utils")
@@ -46,31 +51,135 @@ def get_landscape(water_offset):
         'evaporation_rate': 0.2,
         'remove_lakes_arg': True,
         'seed': 42,
+        ### erosion args, e.g. {'method': 'multigrid', 'levels': 3}
+        'erosion': None,
     }
 
     if not os.path.exists(terrain_config['npz_path']):
-        print(f'No file found at {npz_path}. Generating new terrain... ')
+        print(f"No file found at {terrain_config['npz_path']}. Generating new terrain... ")
         terrain_config['generate_terrain'] = True
     if terrain_config['generate_terrain']:
-        river_network.main(
+        terrain = pipeline.TerrainPipeline().river_network(
             ### = terrain_config[''],
             dim = terrain_config['dim'],
-            output_path = terrain_config['npz_path'],
             seed = terrain_config['seed'],
             default_water_level = terrain_config['default_water_level'],
-        )
-    landscape = blender_io.load_npz_terrain_with_river_displace(
-        terrain_config['npz_path'], 
+        ).save(terrain_config['npz_path'])
+    else:
+        terrain = pipeline.TerrainPipeline.from_npz(terrain_config['npz_path'])
+
+    # The mesh is cached per terrain contents and loading args, so reloads are
+    # fast. The terrain is already in memory, so it is built from there.
+    def build(npz_path, **params):
+        return build_landscape(terrain, **params)
+
+    landscape = blender_io.load_cached_terrain(
+        terrain_config['npz_path'],
+        build,
+        source_hash=terrain.content_hash(),
         name=terrain_config['name'], 
         scale_xy=terrain_config['scale_xy'], 
         scale_z=terrain_config['scale_z'],
         displace_strength=terrain_config['displace_strength'],
-        #chunk_range = [0,0,256,256],### TODO: this does not work
-        #npy_path = './river_network_42_1024_npy'
+        erosion=terrain_config['erosion'],
+    )
+    landscape.location = (-dim*scale_xy/2, dim*scale_xy/2, water_offset)
+    return landscape
+
+def build_landscape(terrain, name, scale_xy, scale_z, displace_strength, erosion=None):
+    if erosion:
+        terrain.erosion(**erosion)
+    return terrain.build_mesh(
+        name=name, 
+        scale_xy=scale_xy, 
+        scale_z=scale_z,
+        displace_strength=displace_strength,
+    )
+
+def get_landscape_tiles(water_offset, npz_path='./river_network_42_1024.npz',
+                        tiles=(8, 8), roi=None, margin=1):
+    # Tiled alternative to get_landscape for an existing npz_path. Call again
+    # with a new roi, e.g. [x_start, x_end, y_start, y_end] in cells, to stream
+    # in the tiles around it.
+    landscape = blender_io.load_terrain_tiles(
+        npz_path,
+        name='landscape_tiles',
+        tiles=tiles,
+        scale_xy=scale_xy,
+        scale_z=scale_z,
+        roi=roi,
+        margin=margin,
+        unload=roi is not None,
     )
     landscape.location = (-dim*scale_xy/2, dim*scale_xy/2, water_offset)
     return landscape
 
+def get_landscape_lod(water_offset, camera, npz_path='./river_network_42_1024.npz',
+                      leaf_cells=32, lod_distance=2.0):
+    # Level-of-detail alternative to get_landscape for an existing npz_path,
+    # refined around `camera`. Call again after moving the camera to update it.
+    location = (-dim*scale_xy/2, dim*scale_xy/2, water_offset)
+    x, y = camera.matrix_world.translation[:2]
+    point = ((x - location[0]) / scale_xy, (location[1] - y) / scale_xy)
+    landscape = blender_io.load_terrain_lod(
+        npz_path,
+        point,
+        name='landscape_lod',
+        scale_xy=scale_xy,
+        scale_z=scale_z,
+        leaf_cells=leaf_cells,
+        lod_distance=lod_distance,
+    )
+    landscape.location = location
+    return landscape
+
+def get_landscape_tin(water_offset, npz_path='./river_network_42_1024.npz',
+                      max_error=0.5/scale_z, cull_water=True):
+    # Adaptive-triangle alternative to get_landscape for an existing npz_path.
+    # max_error is in heightmap units (0.5/scale_z = half a world unit). With
+    # cull_water, terrain below the get_ocean plane (z=0) is dropped.
+    landscape = blender_io.load_terrain_tin(
+        npz_path,
+        max_error,
+        name='landscape_tin',
+        scale_xy=scale_xy,
+        scale_z=scale_z,
+        water_level=-water_offset/scale_z if cull_water else None,
+    )
+    landscape.location = (-dim*scale_xy/2, dim*scale_xy/2, water_offset)
+    return landscape
+
+def get_rivers(water_offset, npz_path='./river_network_42_1024.npz',
+               volume_quantile=0.9):
+    # Only the segments above the `volume_quantile` of river volume are built,
+    # i.e. the largest 10% by default.
+    rivers = blender_io.load_river_ribbons(
+        npz_path,
+        name='rivers',
+        scale_xy=scale_xy,
+        scale_z=scale_z,
+        volume_quantile=volume_quantile,
+        z_offset=0.5/scale_z,
+    )
+    rivers.location = (-dim*scale_xy/2, dim*scale_xy/2, water_offset)
+    return rivers
+
+def get_coastlines(water_offset, npz_path='./river_network_42_1024.npz',
+                   spacing=None, min_length=0.0):
+    # Coastlines where the landscape of get_landscape meets the get_ocean
+    # plane, in world space, traced from the heightmap without any mesh.
+    with np.load(npz_path) as data:
+        height = data['height']
+    return coastline.coastlines(
+        height,
+        coastline.water_level(water_offset, scale_z),
+        location=(-dim*scale_xy/2, dim*scale_xy/2, water_offset),
+        scale_xy=scale_xy,
+        scale_z=scale_z,
+        spacing=spacing,
+        min_length=min_length,
+    )
+
 def get_ocean():
     bpy.ops.mesh.primitive_plane_add(size=dim*scale_xy, location=(0,0,0))
     water = bpy.context.active_object
@@ -0,0 +1,159 @@
+# Quadtree level of detail for large heightmaps. The heightmap is covered by a
+# quadtree whose leaves are nodes of `leaf_cells` x `leaf_cells` quads each, so
+# a node at depth d samples the heightmap every 2 ** (levels - d) cells. Nodes
+# are split while a point of interest (e.g. the camera) is close relative to
+# their size, and the tree is balanced so that neighboring nodes differ by at
+# most one level. Where a node borders a coarser one, its odd edge vertices are
+# snapped onto the coarser edge, so the seams have no cracks:
+#   nodes = lod.build_lod(height, point=(512, 300), lod_distance=2.0)
+#   for node in nodes:
+#     mesh(node['height'], rows=node['rows'], cols=node['cols'])
+# The selection itself works on a small map with one entry per finest node.
+# Nodes are clipped to the heightmap, so it need not be a power of two in size.
+
+import numpy as np
+
+
+# Returns the number of quadtree levels below the root needed to cover `shape`
+# with nodes of `leaf_cells` cells at full resolution.
+def num_levels(shape, leaf_cells=32):
+    cells = max(shape) - 1
+    return max(0, int(np.ceil(np.log2(max(cells / leaf_cells, 1)))))
+
+
+# Returns a (2 ** levels, 2 ** levels) map of the depth of the node covering
+# each finest-level unit. Nodes are split while the distance from `point`
+# (x, y) to them, in units, is below `lod_distance` times their size.
+def select_depths(levels, point, lod_distance=2.0):
+    n_units = 2 ** levels
+    depths = np.zeros((n_units, n_units), dtype=np.int32)
+    (x, y) = point
+    stack = [(0, 0, 0)]
+    while stack:
+        (depth, i, j) = stack.pop()
+        size = 2 ** (levels - depth)
+        dx = max(j * size - x, 0, x - (j + 1) * size)
+        dy = max(i * size - y, 0, y - (i + 1) * size)
+        if depth < levels and np.hypot(dx, dy) < lod_distance * size:
+            stack.extend((depth + 1, 2 * i + di, 2 * j + dj)
+                         for di in (0, 1) for dj in (0, 1))
+        else:
+            depths[i * size:(i + 1) * size, j * size:(j + 1) * size] = depth
+    return balance_depths(depths, levels)
+
+
+# Splits nodes until every node differs by at most one level from its edge
+# neighbors (a restricted quadtree), in place.
+def balance_depths(depths, levels):
+    while True:
+        padded = np.pad(depths, 1, mode='edge')
+        neighbor = np.maximum.reduce([padded[:-2, 1:-1], padded[2:, 1:-1],
+                                      padded[1:-1, :-2], padded[1:-1, 2:]])
+        [rows, cols] = np.nonzero(neighbor > depths + 1)
+        if len(rows) == 0:
+            return depths
+        # Split each offending node once, i.e. deepen its whole block.
+        size = 2 ** (levels - depths[rows, cols])
+        for (r, c, s) in set(zip(rows // size * size, cols // size * size, size)):
+            depths[r:r + s, c:c + s] += 1
+
+
+# Returns the nodes of a depth map as (depth, unit row, unit col, unit size).
+def leaf_nodes(depths, levels):
+    nodes = []
+    for depth in np.unique(depths):
+        size = 2 ** (levels - depth)
+        [rows, cols] = np.nonzero(depths[::size, ::size] == depth)
+        nodes.extend((int(depth), int(r) * size, int(c) * size, size)
+                     for (r, c) in zip(rows, cols))
+    return nodes
+
+
+# Returns the sample positions of a node side that starts at grid point
+# `start` and spans `count` steps of `step`, clipped to the `n` grid points of
+# the heightmap. If the clip falls between two samples, the last grid point is
+# added as a final, shorter step.
+def _positions(start, count, step, n):
+    end = min(start + count * step, n - 1)
+    positions = np.arange(start, end + 1, step)
+    if positions[-1] != end:
+        positions = np.append(positions, end)
+    return positions
+
+
+# Returns the slices that read `positions` (evenly spaced by `step`, except
+# maybe the last) from the source.
+def _slices(positions, step):
+    regular = (positions[-1] - positions[0]) % step == 0
+    last = positions[-1] if regular else positions[-2]
+    slices = [slice(positions[0], last + 1, step)]
+    if not regular:
+        slices.append(slice(positions[-1], positions[-1] + 1))
+    return slices
+
+
+# Reads `height` at the grid points `rows` x `cols` with at most four sliced
+# reads, so memory-mapped heightmaps and chunk stores only load the samples.
+def _read_samples(height, rows, cols, step):
+    return np.block([[np.asarray(height[r, c], dtype=np.float32)
+                      for c in _slices(cols, step)]
+                     for r in _slices(rows, step)])
+
+
+# Moves the samples of a node edge at `positions` onto the edge of a node one
+# level coarser, which only has every other sample and the last one.
+def _snap_edge(edge, positions):
+    coarse = np.union1d(np.arange(0, len(positions), 2), [len(positions) - 1])
+    edge[:] = np.interp(positions, positions[coarse], edge[coarse])
+
+
+# Builds the level-of-detail nodes of `height` for a point of interest `point`
+# (x, y), in cells. `leaf_cells` must be even. Nodes are clipped to the extent
+# of the heightmap, and nodes past it are dropped; the heightmap is only read
+# where nodes sample it. Returns a list of node dicts with the `depth`, the
+# `origin` (row, col) and sampling `step` in cells, the sample `rows` and
+# `cols` in cells, and the `height` samples of the node, at most a
+# (leaf_cells + 1) square array, whose seams match its neighbors.
+def build_lod(height, point, leaf_cells=32, lod_distance=2.0, levels=None):
+    if leaf_cells < 2 or leaf_cells % 2:
+        raise ValueError('leaf_cells must be a positive even number, got %r'
+                         % (leaf_cells,))
+    (n_rows, n_cols) = height.shape
+    if levels is None:
+        levels = num_levels(height.shape, leaf_cells)
+
+    depths = select_depths(levels, (point[0] / leaf_cells,
+                                    point[1] / leaf_cells), lod_distance)
+    padded = np.pad(depths, 1, mode='constant', constant_values=levels + 1)
+
+    nodes = []
+    for (depth, r, c, s) in leaf_nodes(depths, levels):
+        step = s
+        (row, col) = (r * leaf_cells, c * leaf_cells)
+        if row >= n_rows - 1 or col >= n_cols - 1: continue
+        rows = _positions(row, leaf_cells, step, n_rows)
+        cols = _positions(col, leaf_cells, step, n_cols)
+        samples = _read_samples(height, rows, cols, step)
+
+        # Neighbors one level coarser, looked up one unit outside each edge.
+        # Neighbors past the extent of the heightmap do not exist.
+        below = (r + s) * leaf_cells < n_rows - 1
+        right = (c + s) * leaf_cells < n_cols - 1
+        if padded[r, c + 1] < depth:
+            _snap_edge(samples[0, :], cols)
+        if below and padded[r + s + 1, c + 1] < depth:
+            _snap_edge(samples[-1, :], cols)
+        if padded[r + 1, c] < depth:
+            _snap_edge(samples[:, 0], rows)
+        if right and padded[r + 1, c + s + 1] < depth:
+            _snap_edge(samples[:, -1], rows)
+
+        nodes.append({
+            'depth': depth,
+            'origin': (row, col),
+            'step': step,
+            'rows': rows,
+            'cols': cols,
+            'height': samples,
+        })
+    return nodes
@@ -0,0 +1,166 @@
+# Domain-decomposed erosion. The grid is split into horizontal strips, one per
+# worker process. The simulation state lives in `multiprocessing.shared_memory`
+# and each worker runs an `ErosionKernel` on its strip plus `halo` rows of its
+# neighbors, which it re-reads every iteration. Reads and writes go to two
+# alternating copies of the state, so one barrier per iteration is enough.
+
+import multiprocessing
+import multiprocessing.connection
+import threading
+
+import numpy as np
+from multiprocessing import shared_memory
+
+import simulation
+import tqdm
+
+
+_FIELDS = ('terrain', 'sediment', 'water', 'velocity')
+
+# Rows of neighboring strips each cell of one iteration depends on: 3 through
+# the downhill sampling and displacement, plus the widest local slippage
+# stencil (thermal erosion only needs 1).
+MIN_HALO = simulation.SLIPPAGE_STENCIL_RADIUS + 3
+
+
+# Returns the shared arrays for each field, in both state copies.
+def _attach(shms, shape):
+    return [{field: np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+             for (field, shm) in zip(_FIELDS, copy)} for copy in shms]
+
+
+# Seconds between checks of the workers while they run.
+_POLL_INTERVAL = 0.1
+
+
+# Worker process for the strip of rows [`row_start`, `row_end`). `progress`,
+# if given, is set to the number of completed iterations.
+def _erode_strip(shm_names, shape, row_start, row_end, halo, params,
+                 cell_width, iterations, seed, barrier, progress=None):
+    shms = [[shared_memory.SharedMemory(name=name) for name in copy]
+            for copy in shm_names]
+    try:
+        _run_strip(_attach(shms, shape), row_start, row_end, halo, params,
+                   cell_width, iterations, seed, barrier, progress)
+    except threading.BrokenBarrierError:
+        pass
+    except BaseException:
+        barrier.abort()
+        raise
+    finally:
+        for copy in shms:
+            for shm in copy:
+                try: shm.close()
+                except BufferError: pass
+
+
+def _run_strip(state, row_start, row_end, halo, params, cell_width,
+               iterations, seed, barrier, progress=None):
+    shape = state[0]['terrain'].shape
+    rows = np.arange(row_start - halo, row_end + halo) % shape[0]
+    interior = slice(halo, halo + row_end - row_start)
+    kernel = simulation.ErosionKernel(
+        np.zeros((len(rows), shape[1]), dtype=np.float32), params, seed=seed,
+        cell_width=cell_width)
+
+    # Rain is added by the owner of each row before the state is shared, so
+    # halo rows see the same precipitation as their owners. Like a serial
+    # `step`, each iteration rains once, at its start.
+    kernel.add_rain(state[0]['water'][row_start:row_end])
+    barrier.wait()
+
+    for i in range(iterations):
+        (src, dst) = (state[i % 2], state[(i + 1) % 2])
+        for field in _FIELDS:
+            np.take(src[field], rows, axis=0, out=getattr(kernel, field))
+        kernel.step(rain=False)
+        for field in _FIELDS:
+            dst[field][row_start:row_end] = getattr(kernel, field)[interior]
+        if i < iterations - 1:
+            kernel.add_rain(dst['water'][row_start:row_end])
+        barrier.wait()
+        if progress is not None: progress.value = i + 1
+
+
+# Erodes `terrain` for `iterations` iterations using `num_workers` processes
+# (defaults to the CPU count). A global FFT blur does not fit the
+# decomposition, so 'fft' slippage is replaced by thermal erosion. Random
+# numbers for flat cells are drawn per worker, so results match a serial run
+# up to rain noise.
+# Returns a dict with the final `terrain`, `sediment`, `water` and `velocity`.
+def erode_parallel(terrain, iterations, params=None, num_workers=None,
+                   halo=MIN_HALO, seed=None):
+    if halo < MIN_HALO:
+        raise ValueError('halo must be at least %d rows' % MIN_HALO)
+    params = dict(simulation.DEFAULT_PARAMS, **(params or {}))
+    if params['slippage'] == 'fft':
+        params['slippage'] = 'thermal'
+    shape = terrain.shape
+    num_workers = min(num_workers or multiprocessing.cpu_count(), shape[0])
+
+    size = int(np.prod(shape)) * np.dtype(np.float32).itemsize
+    shms = [[shared_memory.SharedMemory(create=True, size=size)
+             for _ in _FIELDS] for _ in range(2)]
+    workers = []
+    try:
+        return _run_workers(shms, terrain, iterations, params, num_workers,
+                            halo, seed, workers)
+    finally:
+        for worker in workers: worker.join()
+        for copy in shms:
+            for shm in copy:
+                shm.unlink()
+                # Views stay alive while an exception propagates.
+                try: shm.close()
+                except BufferError: pass
+
+
+def _run_workers(shms, terrain, iterations, params, num_workers, halo, seed,
+                 workers):
+    shape = terrain.shape
+    state = _attach(shms, shape)
+    for field in _FIELDS: state[0][field][:] = 0.0
+    state[0]['terrain'][:] = terrain
+
+    shm_names = [[shm.name for shm in copy] for copy in shms]
+    cell_width = params['full_width'] / shape[0]
+    bounds = np.linspace(0, shape[0], num_workers + 1).astype(int)
+    seeds = np.random.SeedSequence(seed).spawn(num_workers)
+    barrier = multiprocessing.Barrier(num_workers)
+    progress = multiprocessing.Value('i', 0, lock=False)
+    try:
+        for k in range(num_workers):
+            worker = multiprocessing.Process(
+                target=_erode_strip,
+                args=(shm_names, shape, bounds[k], bounds[k + 1], halo, params,
+                      cell_width, iterations, seeds[k], barrier,
+                      progress if k == 0 else None))
+            worker.start()
+            workers.append(worker)
+        _monitor(workers, barrier, progress, iterations)
+    except BaseException:
+        barrier.abort()
+        raise
+
+    return {field: state[iterations % 2][field].copy() for field in _FIELDS}
+
+
+# Waits for the workers to finish, showing their progress. Workers only wait
+# on each other, so one that dies without aborting the barrier (e.g. killed,
+# or failing on import) is noticed here by its exit code, instead of hanging.
+def _monitor(workers, barrier, progress, iterations):
+    with tqdm.tqdm(total=iterations) as bar:
+        while True:
+            exitcodes = [worker.exitcode for worker in workers]
+            bar.update(progress.value - bar.n)
+            if any(code not in (None, 0) for code in exitcodes):
+                raise RuntimeError('An erosion worker failed with exit code '
+                                   '%d.' % next(code for code in exitcodes
+                                                if code not in (None, 0)))
+            if all(code == 0 for code in exitcodes):
+                break
+            multiprocessing.connection.wait(
+                [worker.sentinel for worker in workers], _POLL_INTERVAL)
+    # Workers that saw an aborted barrier exit cleanly.
+    if barrier.broken:
+        raise RuntimeError('An erosion worker failed.')
@@ -0,0 +1,105 @@
+# Composable in-memory terrain pipeline. Each stage reads and writes the arrays
+# in `TerrainPipeline.arrays` (`height`, `land_mask`, the river graph, derived
+# rasters, ...), so generation, erosion and mesh building never go through disk
+# unless `save` is called:
+#   pipeline = TerrainPipeline().river_network(dim=1024, seed=42)
+#   pipeline.erosion('multigrid', levels=3).derived()
+#   landscape = pipeline.build_mesh(name='landscape', scale_xy=8, scale_z=512)
+#   pipeline.save('./river_network_42_1024.npz')
+
+import hashlib
+
+import numpy as np
+
+import chunkstore
+import derived
+import droplets
+import river_network
+import simulation
+
+
+# The erosion engines, all taking a heightmap and yielding snapshots.
+EROSION_METHODS = {
+    'grid': simulation.erode,
+    'multigrid': simulation.erode_multigrid,
+    'droplets': droplets.erode,
+}
+
+
+class TerrainPipeline:
+    def __init__(self, arrays=None):
+        self.arrays = dict(arrays or {})
+
+    # Starts a pipeline from the arrays of an existing .npz file.
+    @classmethod
+    def from_npz(cls, npz_path):
+        with np.load(npz_path) as data:
+            return cls({key: data[key] for key in data.files})
+
+    # Starts a pipeline from all arrays of a chunk store, at full resolution.
+    @classmethod
+    def from_store(cls, root):
+        return cls(chunkstore.ChunkStore(root).load_all())
+
+    # Generates the terrain and river network. Takes the arguments of
+    # `river_network.generate`.
+    def river_network(self, **kwargs):
+        self.arrays.update(river_network.generate(**kwargs))
+        return self
+
+    # Erodes the current height with one of `EROSION_METHODS`. `kwargs` are
+    # passed on to the engine; only its final snapshot is kept. If the engine
+    # yields none (e.g. zero iterations), the height is left unchanged.
+    def erosion(self, method='multigrid', params=None, **kwargs):
+        if method not in EROSION_METHODS:
+            raise ValueError(f'Unknown erosion method {method!r}, expected one '
+                             f'of {sorted(EROSION_METHODS)}.')
+        snapshot = None
+        for snapshot in EROSION_METHODS[method](self.arrays['height'], params,
+                                                **kwargs):
+            pass
+        if snapshot is not None:
+            self.arrays['height'] = snapshot['terrain']
+        return self
+
+    # Computes the derived `rasters` (slope, aspect, curvature and flow by
+    # default) of the current height.
+    def derived(self, cell_width=1.0, rasters=derived.RASTERS):
+        self.arrays.update(derived.compute_derived(self.arrays['height'],
+                                                   cell_width, rasters))
+        return self
+
+    # Builds the Blender terrain object from the current arrays. The arrays
+    # named in `attributes` are stored as vertex attributes for materials;
+    # missing derived rasters are computed (only those), other missing arrays
+    # are skipped. Takes the arguments of `blender_io.load_terrain_arrays`.
+    def build_mesh(self, attributes=('land_mask', 'slope'), **kwargs):
+        from utils import blender_io
+        missing = [key for key in attributes
+                   if key in derived.RASTERS and key not in self.arrays]
+        if missing:
+            self.derived(rasters=missing)
+        return blender_io.load_terrain_arrays(
+            self.arrays['height'], self.arrays.get('river'),
+            attributes={key: self.arrays[key] for key in attributes
+                        if key in self.arrays},
+            **kwargs)
+
+    # Returns a hex digest that identifies the contents of all arrays.
+    def content_hash(self):
+        h = hashlib.sha1()
+        for key in sorted(self.arrays):
+            h.update((key + derived.height_hash(self.arrays[key])).encode())
+        return h.hexdigest()
+
+    # Saves the arrays named in `keys` (all by default) to an .npz file.
+    def save(self, npz_path, keys=None):
+        keys = self.arrays.keys() if keys is None else keys
+        np.savez(npz_path, **{key: self.arrays[key] for key in keys})
+        return self
+
+    # Saves the arrays to a chunk store. Takes the arguments of
+    # `chunkstore.write`.
+    def save_store(self, root, **kwargs):
+        chunkstore.write(root, self.arrays, **kwargs)
+        return self
@@ -19,6 +19,7 @@ import skimage.measure
 import sys
 import util
 importlib.reload(util)
+import chunkstore
 
 # Returns the index of the smallest value of `a`
 def min_index(a): return a.index(min(a))
@@ -161,6 +162,51 @@ def compute_river_network(points, neighbors, heights, land,
     return (upstream, downstream, volume)
 
 
+# Returns the Strahler stream order of each point. Sources have order 1, and
+# the order only increases where two streams of the same order meet.
+def compute_strahler_order(upstream, downstream):
+    num_points = len(downstream)
+    order = np.ones(num_points, dtype=np.int32)
+    max_upstream_order = np.zeros(num_points, dtype=np.int32)
+    max_upstream_count = np.zeros(num_points, dtype=np.int32)
+
+    # Visit points from the sources down, so that every point is only finalized
+    # once all of its upstream points are.
+    pending = [len(u) for u in upstream]
+    q = collections.deque(i for i in range(num_points) if pending[i] == 0)
+    while len(q) > 0:
+        i = q.popleft()
+        if max_upstream_count[i] > 1:
+            order[i] = max_upstream_order[i] + 1
+        elif max_upstream_count[i] == 1:
+            order[i] = max_upstream_order[i]
+
+        j = downstream[i]
+        if j is None: continue
+        if order[i] > max_upstream_order[j]:
+            max_upstream_order[j] = order[i]
+            max_upstream_count[j] = 1
+        elif order[i] == max_upstream_order[j]:
+            max_upstream_count[j] += 1
+        pending[j] -= 1
+        if pending[j] == 0: q.append(j)
+
+    return order
+
+
+# Packs the river graph into compact arrays that can be stored next to the
+# heightmap. Points without a downstream point get a downstream index of -1.
+def export_river_graph(points, downstream, volume, order, heights):
+    return {
+        'river_points': np.asarray(points, dtype=np.float32),
+        'river_downstream': np.array(
+            [-1 if j is None else j for j in downstream], dtype=np.int32),
+        'river_volume': np.asarray(volume, dtype=np.float32),
+        'river_order': np.asarray(order, dtype=np.uint8),
+        'river_height': np.asarray(heights, dtype=np.float32),
+    }
+
+
 # Renders `values` for each triangle in `tri` on an array the size of `shape`.
 def render_triangulation(shape, tri, values):
     points = util.make_grid_points(shape)
@@ -179,8 +225,10 @@ def remove_lakes(mask):
     return new_mask
 
 
-#def main(argv):
-def main(
+# Generates the terrain and river network in memory. Returns a dict with the
+# `height` and `land_mask` arrays and the river graph arrays (see
+# `export_river_graph`), i.e. everything `main` saves.
+def generate(
     dim = 128,
     #shape = (dim,) * 2,
     disc_radius = 1.0,
@@ -190,7 +238,6 @@ def main(
     default_water_level = 1.0,
     evaporation_rate = 0.2,
     remove_lakes_arg = True,
-    output_path = 'river_network',
     seed = None,
     ):
 
@@ -237,9 +284,47 @@ def main(
         points, neighbors, points_deltas, volume, upstream, 
         max_delta, river_downcutting_constant)
     terrain_height = render_triangulation(shape, tri, new_height)
-    
-    np.savez(output_path, height=terrain_height, land_mask=land_mask)
-    return terrain_height
+
+    print('  ...river graph')
+    river_order = compute_strahler_order(upstream, downstream)
+    river_graph = export_river_graph(
+        points, downstream, volume, river_order, new_height)
+
+    return dict(height=terrain_height, land_mask=land_mask, **river_graph)
+
+
+#def main(argv):
+def main(
+    dim = 128,
+    #shape = (dim,) * 2,
+    disc_radius = 1.0,
+    max_delta = 0.05,
+    river_downcutting_constant = 1.3,
+    directional_inertia = 0.4,
+    default_water_level = 1.0,
+    evaporation_rate = 0.2,
+    remove_lakes_arg = True,
+    output_path = 'river_network',
+    store_path = None,
+    seed = None,
+    ):
+
+    result = generate(
+        dim=dim,
+        disc_radius=disc_radius,
+        max_delta=max_delta,
+        river_downcutting_constant=river_downcutting_constant,
+        directional_inertia=directional_inertia,
+        default_water_level=default_water_level,
+        evaporation_rate=evaporation_rate,
+        remove_lakes_arg=remove_lakes_arg,
+        seed=seed,
+    )
+    np.savez(output_path, **result)
+    # Optional chunked, quantized multi-resolution copy for windowed reads
+    if store_path is not None:
+        chunkstore.write(store_path, result)
+    return result['height']
 
 
 if __name__ == '__main__':
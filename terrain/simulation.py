@@ -9,12 +9,17 @@
 # With some theoretical inspiration from here:
 #   https://hal.inria.fr/inria-00402079/document
 
+import json
 import numpy as np
 import scipy as sp
+import scipy.ndimage
 import matplotlib.pyplot as plt
 import os
+import queue
 import sys
+import threading
 import util
+import chunkstore
 
 import tqdm
 
@@ -29,124 +34,755 @@ def apply_slippage(terrain, repose_slope, cell_width):
   return result
 
 
-def main(argv):
-  # Grid dimension constants
-  full_width = 200
-  dim = 128#512
-  shape = [dim] * 2
-  cell_width = full_width / dim
-  cell_area = cell_width ** 2
-
-  save_every = 20
-    
-  # Snapshotting parameters. Only needed for generating the simulation
-  # timelapse.
-  enable_snapshotting = True
-  my_dir = os.path.dirname(argv[0])
-  snapshot_dir = os.path.join(my_dir, 'sim_snaps')
-  snapshot_file_template = 'sim-%05d.png'
-  if enable_snapshotting:
-    try: os.mkdir(snapshot_dir)
-    except: pass
+# Physical constants of the simulation. The rain rate is per unit of cell area,
+# and the cell width is `full_width` divided by the grid dimension.
+DEFAULT_PARAMS = {
+  'full_width': 200,
 
   # Water-related constants
-  rain_rate = 0.0008 * cell_area
-  evaporation_rate = 0.0005
+  'rain_rate': 0.0008,
+  'evaporation_rate': 0.0005,
 
   # Slope constants
-  min_height_delta = 0.05
-  repose_slope = 0.03
-  gravity = 30.0
-  gradient_sigma = 0.5
+  'min_height_delta': 0.05,
+  'repose_slope': 0.03,
+  'gravity': 30.0,
 
   # Sediment constants
-  sediment_capacity_constant = 50.0
-  dissolving_rate = 0.25
-  deposition_rate = 0.001
+  'sediment_capacity_constant': 50.0,
+  'dissolving_rate': 0.25,
+  'deposition_rate': 0.001,
 
-  # The numer of iterations is proportional to the grid dimension. This is to 
-  # allow changes on one side of the grid to affect the other side.
-  iterations = int(1.4 * dim)
-  #iterations = 1000
+  # How steep slopes are smoothed: 'thermal' moves material between
+  # neighboring cells that exceed the repose slope (see
+  # `apply_thermal_erosion`), 'fft' blurs the whole grid like `apply_slippage`,
+  # and 'stencil' uses a truncated gaussian stencil that only reads
+  # `SLIPPAGE_STENCIL_RADIUS` cells around each cell.
+  'slippage': 'thermal',
 
-  # `terrain` represents the actual terrain height we're interested in
-  terrain = util.fbm(shape, -2.0)
+  # Fraction of the excess height moved per iteration by thermal erosion.
+  'thermal_rate': 0.5,
+}
 
-  # `sediment` is the amount of suspended "dirt" in the water. Terrain will be
-  # transfered to/from sediment depending on a number of different factors.
-  sediment = np.zeros_like(terrain)
+SLIPPAGE_STENCIL_RADIUS = 4
 
-  # The amount of water. Responsible for carrying sediment.
-  water = np.zeros_like(terrain)
 
-  # The water velocity.
-  velocity = np.zeros_like(terrain)
+# Returns a list of (destination, source) slice pairs that implement
+# `np.roll(x, shift)` along an axis as slice assignments.
+def _roll_slices(shift):
+  if shift == 0:
+    return [(slice(None), slice(None))]
+  if shift > 0:
+    return [(slice(shift, None), slice(None, -shift)),
+            (slice(None, shift), slice(-shift, None))]
+  return [(slice(None, shift), slice(-shift, None)),
+          (slice(shift, None), slice(None, -shift))]
+
+
+# Adds `src` rolled by `dy` rows and `dx` columns to `dst`, in place.
+def _add_rolled(dst, src, dy, dx):
+  for (dst_rows, src_rows) in _roll_slices(dy):
+    for (dst_cols, src_cols) in _roll_slices(dx):
+      dst[dst_rows, dst_cols] += src[src_rows, src_cols]
+
+
+# Writes `0.5 * (np.roll(a, 1, axis) - np.roll(a, -1, axis))` to `out`.
+def _central_difference(a, axis, out):
+  a = np.moveaxis(a, axis, 0)
+  o = np.moveaxis(out, axis, 0)
+  np.subtract(a[:-2], a[2:], out=o[1:-1])
+  np.subtract(a[-1], a[1], out=o[0])
+  np.subtract(a[-2], a[0], out=o[-1])
+  out *= 0.5
+
+
+# The 8 neighbor offsets (dy, dx) and their distances, in cells.
+_NEIGHBORS = [((dy, dx), np.hypot(dy, dx))
+              for dy in range(-1, 2) for dx in range(-1, 2) if (dy, dx) != (0, 0)]
+
+
+# Writes `a - np.roll(a, (-dy, -dx), axis=(0, 1))` to `out`, i.e. the height
+# difference of every cell to its neighbor at offset (dy, dx).
+def _neighbor_difference(a, dy, dx, out):
+  for (dst_rows, src_rows) in _roll_slices(-dy):
+    for (dst_cols, src_cols) in _roll_slices(-dx):
+      np.subtract(a[dst_rows, dst_cols], a[src_rows, src_cols],
+                  out=out[dst_rows, dst_cols])
+
+
+# Thermal erosion with caller-provided scratch buffers, see
+# `apply_thermal_erosion`.
+def _thermal_erosion(terrain, repose_slope, cell_width, rate, difference,
+                     total_excess, max_excess, delta):
+  # First pass: total and largest height excess over the repose slope.
+  total_excess.fill(0.0)
+  max_excess.fill(0.0)
+  for ((dy, dx), distance) in _NEIGHBORS:
+    _neighbor_difference(terrain, dy, dx, out=difference)
+    difference -= repose_slope * cell_width * distance
+    np.maximum(difference, 0.0, out=difference)
+    total_excess += difference
+    np.maximum(max_excess, difference, out=max_excess)
+  if not max_excess.any(): return terrain
+
+  # Each cell sheds `rate` times half of its largest excess (moving half the
+  # difference levels the pair), split between its downhill neighbors in
+  # proportion to their excess.
+  np.multiply(max_excess, 0.5 * rate, out=max_excess)
+  np.divide(max_excess, total_excess, out=max_excess, where=total_excess > 0)
+  delta.fill(0.0)
+  for ((dy, dx), distance) in _NEIGHBORS:
+    _neighbor_difference(terrain, dy, dx, out=difference)
+    difference -= repose_slope * cell_width * distance
+    np.maximum(difference, 0.0, out=difference)
+    difference *= max_excess
+    delta -= difference
+    _add_rolled(delta, difference, dy, dx)
+  terrain += delta
+  return terrain
 
-  for i in tqdm.tqdm(range(0, iterations)):
-    #print('%d / %d' % (i + 1, iterations))
 
-    # Add precipitation. This is done by via simple uniform random distribution,
-    # although other models use a raindrop model
-    water += np.random.rand(*shape) * rain_rate
+# Talus-based thermal erosion: wherever the slope to one of the 8 neighbors
+# exceeds `repose_slope`, material slides from the cell to those neighbors.
+# This is the local counterpart of `apply_slippage`: only neighboring cells
+# exchange material, and the total height is conserved. Updates `terrain` in
+# place and returns it.
+def apply_thermal_erosion(terrain, repose_slope, cell_width, rate=0.5):
+  buffers = [np.empty_like(terrain) for _ in range(4)]
+  return _thermal_erosion(terrain, repose_slope, cell_width, rate, *buffers)
 
-    # Compute the normalized gradient of the terrain height to determine where 
+
+# The hydraulic erosion step of `main`, rewritten to update terrain, water,
+# sediment and velocity in place. All temporaries are float32 buffers that are
+# allocated once, so memory use stays flat over the whole run.
+class ErosionKernel:
+  def __init__(self, terrain, params=None, seed=None, cell_width=None):
+    self.params = dict(DEFAULT_PARAMS, **(params or {}))
+    if self.params['slippage'] not in ('thermal', 'fft', 'stencil'):
+      raise ValueError('Unknown slippage mode %r' % self.params['slippage'])
+    self.shape = terrain.shape
+    self.cell_width = cell_width or self.params['full_width'] / self.shape[0]
+    self.rng = np.random.default_rng(seed)
+
+    zeros = lambda dtype=np.float32: np.zeros(self.shape, dtype=dtype)
+    self.terrain = np.array(terrain, dtype=np.float32)
+    self.sediment = zeros()
+    self.water = zeros()
+    self.velocity = zeros()
+
+    # Unit gradient (downhill direction) split into column and row components.
+    self._gx = zeros()
+    self._gy = zeros()
+    self._height_delta = zeros()
+    self._a = zeros()
+    self._b = zeros()
+    self._c = zeros()
+    self._d = zeros()
+    self._spare = zeros()
+    self._mask = zeros(bool)
+    self._index = zeros(np.intp)
+    self._row0 = zeros(np.intp)
+    self._row1 = zeros(np.intp)
+    self._col0 = zeros(np.intp)
+    self._col1 = zeros(np.intp)
+
+    # Displacement weights for offsets of -1, 0 and 1 along each axis.
+    self._wx = np.zeros((3,) + self.shape, dtype=np.float32)
+    self._wy = np.zeros((3,) + self.shape, dtype=np.float32)
+
+    # Copy of the terrain before the current step, only allocated when metrics
+    # are requested.
+    self._previous_terrain = None
+    self._previous_sediment = None
+
+    self._row_coords = np.arange(self.shape[0], dtype=np.float32)[:, np.newaxis]
+    self._col_coords = np.arange(self.shape[1], dtype=np.float32)[np.newaxis, :]
+
+    # The blur kernel of `util.gaussian_blur` never changes, so its spectrum (or
+    # its separable stencil weights) is computed once.
+    sigma = 1.5
+    if self.params['slippage'] == 'fft':
+      freqs = tuple(np.fft.fftfreq(n, d=1.0 / n) for n in self.shape)
+      freq_radial = np.hypot(*np.meshgrid(*freqs, indexing='ij'))
+      blur_kernel = np.exp(-0.5 * (freq_radial / sigma)**2)
+      blur_kernel /= blur_kernel.sum()
+      self._blur_spectrum = np.fft.rfft2(blur_kernel)
+    elif self.params['slippage'] == 'stencil':
+      offsets = np.arange(-SLIPPAGE_STENCIL_RADIUS, SLIPPAGE_STENCIL_RADIUS + 1)
+      weights = np.exp(-0.5 * (offsets / sigma)**2)
+      self._blur_weights = list(zip(offsets, weights / weights.sum()))
+
+  # Advances the simulation by one iteration. With `rain=False` the caller is
+  # responsible for adding precipitation to `water` beforehand. With
+  # `metrics=True`, returns a dict of change metrics for this iteration (see
+  # `_change_metrics`).
+  def step(self, rain=True, metrics=False):
+    if metrics:
+      if self._previous_terrain is None:
+        self._previous_terrain = np.empty_like(self.terrain)
+      np.copyto(self._previous_terrain, self.terrain)
+
+    p = self.params
+    terrain, sediment, water = self.terrain, self.sediment, self.water
+    height_delta = self._height_delta
+    cell_width = self.cell_width
+
+    # Add precipitation.
+    if rain:
+      self.add_rain(water)
+
+    # Compute the normalized gradient of the terrain height to determine where
     # water and sediment will be moving.
-    gradient = np.zeros_like(terrain, dtype='complex')
-    gradient = util.simple_gradient(terrain)
-    gradient = np.select([np.abs(gradient) < 1e-10],
-                             [np.exp(2j * np.pi * np.random.rand(*shape))],
-                             gradient)
-    gradient /= np.abs(gradient)
+    self._compute_gradient()
 
     # Compute the difference between the current height the height offset by
-    # `gradient`.
-    neighbor_height = util.sample(terrain, -gradient)
-    height_delta = terrain - neighbor_height
-    
+    # the gradient.
+    self._sample_downhill(out=self._a)
+    np.subtract(terrain, self._a, out=height_delta)
+
     # The sediment capacity represents how much sediment can be suspended in
-    # water. If the sediment exceeds the quantity, then it is deposited,
-    # otherwise terrain is eroded.
-    sediment_capacity = (
-        (np.maximum(height_delta, min_height_delta) / cell_width) * velocity *
-        water * sediment_capacity_constant)
-    deposited_sediment = np.select(
-        [
-          height_delta < 0, 
-          sediment > sediment_capacity,
-        ], [
-          np.minimum(height_delta, sediment),
-          deposition_rate * (sediment - sediment_capacity),
-        ],
-        # If sediment <= sediment_capacity
-        dissolving_rate * (sediment - sediment_capacity))
+    # water.
+    capacity = self._a
+    np.maximum(height_delta, p['min_height_delta'], out=capacity)
+    capacity *= p['sediment_capacity_constant'] / cell_width
+    capacity *= self.velocity
+    capacity *= water
+
+    # If the sediment exceeds the capacity it is deposited, otherwise terrain
+    # is eroded. Downhill of a pit, the pit is filled instead.
+    excess = self._b
+    deposited = self._c
+    np.subtract(sediment, capacity, out=excess)
+    np.multiply(excess, p['dissolving_rate'], out=deposited)
+    np.greater(excess, 0, out=self._mask)
+    np.multiply(excess, p['deposition_rate'], out=deposited, where=self._mask)
+    np.less(height_delta, 0, out=self._mask)
+    np.minimum(height_delta, sediment, out=deposited, where=self._mask)
 
     # Don't erode more sediment than the current terrain height.
-    deposited_sediment = np.maximum(-height_delta, deposited_sediment)
+    np.negative(height_delta, out=self._b)
+    np.maximum(self._b, deposited, out=deposited)
 
     # Update terrain and sediment quantities.
-    sediment -= deposited_sediment
-    terrain += deposited_sediment
-    sediment = util.displace(sediment, gradient)
-    water = util.displace(water, gradient)
+    sediment -= deposited
+    terrain += deposited
+    self._compute_displace_weights()
+    self.sediment = self._displace(self.sediment)
+    self.water = self._displace(self.water)
 
     # Smooth out steep slopes.
-    terrain = apply_slippage(terrain, repose_slope, cell_width)
+    self._apply_slippage()
 
     # Update velocity
-    velocity = gravity * height_delta / cell_width
-  
+    np.multiply(height_delta, p['gravity'] / cell_width, out=self.velocity)
+
     # Apply evaporation
-    water *= 1 - evaporation_rate
+    self.water *= 1 - p['evaporation_rate']
+
+    if metrics: return self._change_metrics()
+
+  # Returns the max and mean absolute terrain change of the last step, the total
+  # suspended sediment and its relative change since the previous call (None on
+  # the first call).
+  def _change_metrics(self):
+    delta = self._previous_terrain
+    np.subtract(self.terrain, delta, out=delta)
+    np.abs(delta, out=delta)
+    sediment = float(self.sediment.sum(dtype=np.float64))
+    previous_sediment = self._previous_sediment
+    self._previous_sediment = sediment
+    if previous_sediment is None:
+      sediment_change = None
+    else:
+      sediment_change = (abs(sediment - previous_sediment) /
+                         max(abs(sediment), 1e-12))
+    return {
+      'max_delta': float(delta.max()),
+      'mean_delta': float(delta.mean(dtype=np.float64)),
+      'sediment': sediment,
+      'sediment_change': sediment_change,
+    }
+
+  # Adds one iteration of uniformly random precipitation to `water`, which may
+  # be any array of the kernel's dtype.
+  def add_rain(self, water):
+    noise = self._a[:water.shape[0], :water.shape[1]]
+    self.rng.random(out=noise, dtype=np.float32)
+    noise *= self.params['rain_rate'] * self.cell_width ** 2
+    water += noise
+
+  # Atomically writes the full simulation state to the .npz file `path`.
+  # `iteration` is the number of completed iterations, i.e. the index of the
+  # next iteration to run, and `calm_iterations` the convergence counter of
+  # `iterate` at that point.
+  def save_checkpoint(self, path, iteration, calm_iterations=0):
+    # The sediment of the last metrics, for the next `sediment_change`.
+    previous_sediment = ({} if self._previous_sediment is None else
+                         {'previous_sediment': self._previous_sediment})
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+      np.savez(f, terrain=self.terrain, sediment=self.sediment,
+               water=self.water, velocity=self.velocity,
+               iteration=iteration, cell_width=self.cell_width,
+               calm_iterations=calm_iterations,
+               params=json.dumps(self.params),
+               rng_state=json.dumps(self.rng.bit_generator.state),
+               **previous_sediment)
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+  # Restores a kernel saved with `save_checkpoint`. Returns a tuple of the
+  # kernel, the index of the next iteration to run and the convergence counter
+  # to pass to `iterate`. Continuing from there gives bit-identical results to
+  # an uninterrupted run.
+  @classmethod
+  def from_checkpoint(cls, path):
+    with np.load(path) as data:
+      # Checkpoints from before `cell_width` was saved used the default.
+      cell_width = (float(data['cell_width']) if 'cell_width' in data.files
+                    else None)
+      kernel = cls(data['terrain'], json.loads(str(data['params'])),
+                   cell_width=cell_width)
+      for name in ('sediment', 'water', 'velocity'):
+        np.copyto(getattr(kernel, name), data[name])
+      rng_state = json.loads(str(data['rng_state']))
+      iteration = int(data['iteration'])
+      calm_iterations = (int(data['calm_iterations'])
+                         if 'calm_iterations' in data.files else 0)
+      if 'previous_sediment' in data.files:
+        kernel._previous_sediment = float(data['previous_sediment'])
+    bit_generator = getattr(np.random, rng_state['bit_generator'])()
+    bit_generator.state = rng_state
+    kernel.rng = np.random.Generator(bit_generator)
+    return (kernel, iteration, calm_iterations)
+
+  # Equivalent to `util.simple_gradient`, normalized, with random directions
+  # assigned to flat cells.
+  def _compute_gradient(self):
+    gx, gy, magnitude = self._gx, self._gy, self._a
+    _central_difference(self.terrain, 1, out=gx)
+    _central_difference(self.terrain, 0, out=gy)
+    np.hypot(gx, gy, out=magnitude)
+
+    np.less(magnitude, 1e-10, out=self._mask)
+    num_flat = np.count_nonzero(self._mask)
+    if num_flat > 0:
+      phase = 2 * np.pi * self.rng.random(num_flat, dtype=np.float32)
+      gx[self._mask] = np.cos(phase)
+      gy[self._mask] = np.sin(phase)
+      magnitude[self._mask] = 1.0
+
+    gx /= magnitude
+    gy /= magnitude
+
+  # Equivalent to `util.sample(terrain, -gradient)`: bilinearly interpolates the
+  # terrain one unit downhill of every cell.
+  def _sample_downhill(self, out):
+    rows, cols = self.shape
+    row_frac, col_frac, top, bottom = self._b, self._c, out, self._d
+    index = self._index
+
+    for (coords, g, frac, lower, upper, n) in (
+        (self._row_coords, self._gy, row_frac, self._row0, self._row1, rows),
+        (self._col_coords, self._gx, col_frac, self._col0, self._col1, cols)):
+      np.add(g, coords, out=frac)
+      np.floor(frac, out=self._spare)
+      np.copyto(lower, self._spare, casting='unsafe')
+      frac -= self._spare
+      np.remainder(lower, n, out=lower)
+      np.add(lower, 1, out=upper)
+      np.remainder(upper, n, out=upper)
+    self._row0 *= cols
+    self._row1 *= cols
+
+    flat_terrain = self.terrain.reshape(-1)
+    for (row, value) in ((self._row0, top), (self._row1, bottom)):
+      np.add(row, self._col0, out=index)
+      np.take(flat_terrain, index, out=value, mode='wrap')
+      np.add(row, self._col1, out=index)
+      np.take(flat_terrain, index, out=self._spare, mode='wrap')
+      self._spare -= value
+      self._spare *= col_frac
+      value += self._spare
+
+    bottom -= top
+    bottom *= row_frac
+    top += bottom
+
+  # Precomputes the per-axis weights used by `_displace`, equivalent to the
+  # ones in `util.displace`.
+  def _compute_displace_weights(self):
+    for (g, w) in ((self._gx, self._wx), (self._gy, self._wy)):
+      np.negative(g, out=w[0])
+      np.abs(g, out=w[1])
+      np.subtract(1.0, w[1], out=w[1])
+      np.copyto(w[2], g)
+      np.maximum(w, 0.0, out=w)
+
+  # Equivalent to `util.displace(a, gradient)`. Returns the displaced array,
+  # which reuses the spare buffer. `a` becomes the new spare buffer.
+  def _displace(self, a):
+    result = self._spare
+    result.fill(0.0)
+    weighted = self._d
+    for dx in range(-1, 2):
+      for dy in range(-1, 2):
+        np.multiply(self._wx[dx + 1], self._wy[dy + 1], out=weighted)
+        weighted *= a
+        _add_rolled(result, weighted, dy, dx)
+    self._spare = a
+    return result
+
+  # Smooths out steep slopes with the configured slippage mode. The 'fft' mode
+  # is equivalent to `apply_slippage`, with the blur kernel spectrum cached.
+  def _apply_slippage(self):
+    terrain = self.terrain
+    if self.params['slippage'] == 'thermal':
+      _thermal_erosion(terrain, self.params['repose_slope'], self.cell_width,
+                       self.params['thermal_rate'], self._a, self._b, self._c,
+                       self._d)
+      return
+
+    slope = self._a
+    _central_difference(terrain, 1, out=self._gx)
+    _central_difference(terrain, 0, out=self._gy)
+    np.hypot(self._gx, self._gy, out=slope)
+    np.greater(slope, self.params['repose_slope'] * self.cell_width,
+               out=self._mask)
+    if not self._mask.any(): return
+
+    if self.params['slippage'] == 'fft':
+      smoothed = np.fft.irfft2(np.fft.rfft2(terrain) * self._blur_spectrum,
+                               s=self.shape)
+    else:
+      smoothed = self._blur_stencil()
+    np.copyto(terrain, smoothed, where=self._mask, casting='unsafe')
+
+  # Separable gaussian blur of the terrain with a stencil of radius
+  # `SLIPPAGE_STENCIL_RADIUS`, using the free scratch buffers.
+  def _blur_stencil(self):
+    (rows_blurred, result, weighted) = (self._b, self._d, self._c)
+    for (src, dst, axis) in ((self.terrain, rows_blurred, 1),
+                             (rows_blurred, result, 0)):
+      dst.fill(0.0)
+      for (offset, weight) in self._blur_weights:
+        np.multiply(src, weight, out=weighted)
+        if axis == 0: _add_rolled(dst, weighted, offset, 0)
+        else: _add_rolled(dst, weighted, 0, offset)
+    return result
+
+
+# Writes terrain snapshots on a background thread so that PNG encoding and
+# disk I/O overlap with the simulation. Snapshots are copied into a fixed pool
+# of `max_pending` buffers; `submit` only blocks when all of them are still
+# waiting to be written. If `frame_stack_path` is given, frames are appended to
+# a single memory-mapped .npy stack of shape (num_frames,) + shape instead of
+# being written as PNGs.
+class SnapshotWriter:
+  def __init__(self, shape, snapshot_dir=None,
+               file_template='sim-%05d.png', frame_stack_path=None,
+               num_frames=None, max_pending=4):
+    self.snapshot_dir = snapshot_dir
+    self.file_template = file_template
+    self.frames = None
+    self.num_written = 0
+    if frame_stack_path is not None:
+      if num_frames is None:
+        raise ValueError('num_frames is required for a frame stack.')
+      self.frames = np.lib.format.open_memmap(
+          frame_stack_path, mode='w+', dtype=np.float32,
+          shape=(num_frames,) + tuple(shape))
+
+    self._free = queue.Queue()
+    for _ in range(max_pending):
+      self._free.put(np.empty(shape, dtype=np.float32))
+    self._pending = queue.Queue()
+    self._error = None
+    self._thread = threading.Thread(target=self._run, daemon=True)
+    self._thread.start()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  # Queues a copy of `terrain` as the snapshot of iteration `i`.
+  def submit(self, i, terrain):
+    self._raise_error()
+    buffer = self._free.get()
+    np.copyto(buffer, terrain, casting='unsafe')
+    self._pending.put((i, buffer))
+
+  # Waits for all queued snapshots to be written.
+  def close(self):
+    if self._thread.is_alive():
+      self._pending.put(None)
+      self._thread.join()
+    if self.frames is not None:
+      self.frames.flush()
+    self._raise_error()
+
+  def _run(self):
+    while True:
+      item = self._pending.get()
+      if item is None: return
+      (i, buffer) = item
+      try:
+        if self._error is None: self._write(i, buffer)
+      except Exception as e:
+        self._error = e
+      finally:
+        self._free.put(buffer)
+
+  def _write(self, i, buffer):
+    if self.frames is not None:
+      self.frames[self.num_written] = buffer
+    else:
+      output_path = os.path.join(self.snapshot_dir, self.file_template % i)
+      util.save_as_png(buffer, output_path)
+    self.num_written += 1
+
+  def _raise_error(self):
+    if self._error is not None:
+      raise RuntimeError('Snapshot writer failed.') from self._error
+
+
+# Steps `kernel` from iteration `start` up to `iterations`, yielding a tuple of
+# `(i, metrics, converged)` after each iteration.
+#
+# If `tolerance` is given, iteration stops early once `convergence_metric` (one
+# of the keys returned by `ErosionKernel.step(metrics=True)`) stays below it for
+# `patience` consecutive iterations. `converged` is True for that last
+# iteration. `calm_iterations` is the count of such iterations so far, e.g.
+# from a checkpoint; the current count is reported in the metrics.
+def iterate(kernel, iterations, start=0, tolerance=None,
+            convergence_metric='mean_delta', patience=10, calm_iterations=0):
+  for i in range(start, iterations):
+    metrics = kernel.step(metrics=True)
+    if tolerance is not None:
+      value = metrics[convergence_metric]
+      if value is not None and value < tolerance: calm_iterations += 1
+      else: calm_iterations = 0
+      metrics['calm_iterations'] = calm_iterations
+    converged = calm_iterations >= patience
+    yield (i, metrics, converged)
+    if converged: return
+
+
+# Runs `kernel` from iteration `start` up to `iterations`, submitting every
+# `save_every`-th terrain to `writer` and checkpointing every
+# `checkpoint_every` iterations to `checkpoint_path`. See `iterate` for the
+# convergence arguments, including `calm_iterations` when resuming.
+#
+# Returns a report dict with the per-iteration metrics, the iteration range
+# that was run and whether the run converged.
+def run(kernel, iterations, start=0, writer=None, save_every=20,
+        checkpoint_path=None, checkpoint_every=200, tolerance=None,
+        convergence_metric='mean_delta', patience=10, calm_iterations=0):
+  report = {
+    'start': start,
+    'end': start,
+    'max_iterations': iterations,
+    'converged': False,
+    'tolerance': tolerance,
+    'convergence_metric': convergence_metric,
+    'metrics': [],
+  }
+
+  steps = iterate(kernel, iterations, start, tolerance, convergence_metric,
+                  patience, calm_iterations)
+  for (i, metrics, converged) in tqdm.tqdm(steps, initial=start,
+                                           total=iterations):
+    #print('%d / %d' % (i + 1, iterations))
+    metrics['iteration'] = i
+    report['metrics'].append(metrics)
+    report['end'] = i + 1
+    report['converged'] = converged
 
     # Snapshot, if applicable.
-    if enable_snapshotting:
+    if writer is not None:
       if i%save_every == 0:
-        output_path = os.path.join(snapshot_dir, snapshot_file_template % i)
-        util.save_as_png(terrain, output_path)
+        writer.submit(i, kernel.terrain)
+
+    if checkpoint_path is not None and (i + 1) % checkpoint_every == 0:
+      kernel.save_checkpoint(checkpoint_path, i + 1,
+                             metrics.get('calm_iterations', 0))
+
+  return report
+
+
+# Erodes `heightmap` (e.g. the `height` array written by river_network) with
+# the given `params` (overrides of `DEFAULT_PARAMS`) and yields a snapshot dict
+# every `every` iterations and after the last one:
+#   for snapshot in simulation.erode(height, {'rain_rate': 0.001}, every=50):
+#     preview(snapshot['terrain'])
+# Each snapshot holds the number of completed iterations, the metrics of the
+# latest iteration, whether the run converged and copies of the requested
+# `fields` of the kernel state. `iterations` defaults to 1.4 times the grid
+# dimension, like `main`. See `iterate` for the convergence arguments.
+def erode(heightmap, params=None, iterations=None, every=10,
+          fields=('terrain',), seed=None, tolerance=None,
+          convergence_metric='mean_delta', patience=10):
+  kernel = ErosionKernel(heightmap, params, seed)
+  if iterations is None:
+    iterations = int(1.4 * max(kernel.shape))
+
+  for (i, metrics, converged) in iterate(kernel, iterations, 0, tolerance,
+                                         convergence_metric, patience):
+    done = converged or i + 1 == iterations
+    if (i + 1) % every == 0 or done:
+      snapshot = {field: getattr(kernel, field).copy() for field in fields}
+      snapshot.update(iteration=i + 1, metrics=metrics, converged=converged)
+      yield snapshot
+
+
+# Halves the resolution of `a` by averaging 2x2 blocks.
+def _downsample(a):
+  (rows, cols) = a.shape
+  return a.reshape(rows // 2, 2, cols // 2, 2).mean(axis=(1, 3))
+
+
+# Doubles the resolution of `a` with periodic bilinear interpolation, matching
+# the wrap-around boundaries of the simulation.
+def _upsample(a):
+  return sp.ndimage.zoom(a, 2, order=1, mode='grid-wrap', grid_mode=True)
+
+
+# Erodes `heightmap` coarse-to-fine over `levels` resolutions, each half the
+# size of the next. The coarsest level runs `coarse_iterations` iterations
+# (1.4 times its dimension by default, like `main`) so large-scale drainage can
+# form cheaply. Each finer level starts from its own original heightmap plus
+# the upsampled erosion of the level below, carries over the upsampled water,
+# sediment and velocity, and runs only `refine_iterations` iterations. The
+# convergence arguments apply to the coarsest level (see `iterate`).
+#
+# Like `erode`, yields a snapshot dict after each level, finest last, with the
+# added `level` index (0 is the finest) and the `shape` of that level.
+def erode_multigrid(heightmap, params=None, levels=3, coarse_iterations=None,
+                    refine_iterations=20, fields=('terrain',), seed=None,
+                    tolerance=None, convergence_metric='mean_delta',
+                    patience=10):
+  factor = 2 ** (levels - 1)
+  if heightmap.shape[0] % factor or heightmap.shape[1] % factor:
+    raise ValueError('Heightmap dimensions must be divisible by %d for %d '
+                     'levels' % (factor, levels))
+
+  pyramid = [np.asarray(heightmap, dtype=np.float32)]
+  for _ in range(levels - 1):
+    pyramid.append(_downsample(pyramid[-1]))
+
+  rng = np.random.default_rng(seed)
+  total_iterations = 0
+  kernel = None
+  for level in reversed(range(levels)):
+    original = pyramid[level]
+    if kernel is None:
+      kernel = ErosionKernel(original, params, rng)
+      iterations = coarse_iterations or int(1.4 * max(original.shape))
+      steps = iterate(kernel, iterations, 0, tolerance, convergence_metric,
+                      patience)
+    else:
+      coarse = kernel
+      kernel = ErosionKernel(original, params, rng)
+      kernel.terrain += _upsample(coarse.terrain - pyramid[level + 1])
+      # Water and sediment are amounts per cell, so they are split between the
+      # 4 finer cells. Velocity carries over as is.
+      np.copyto(kernel.sediment, _upsample(coarse.sediment) / 4)
+      np.copyto(kernel.water, _upsample(coarse.water) / 4)
+      np.copyto(kernel.velocity, _upsample(coarse.velocity))
+      steps = iterate(kernel, refine_iterations)
+
+    (metrics, converged) = (None, False)
+    for (i, metrics, converged) in steps:
+      total_iterations += 1
+
+    snapshot = {field: getattr(kernel, field).copy() for field in fields}
+    snapshot.update(iteration=total_iterations, metrics=metrics,
+                    converged=converged, level=level, shape=kernel.shape)
+    yield snapshot
+
+
+# Runs a new simulation, or continues the one in the checkpoint file when
+# called with `--resume`.
+def main(argv):
+  # Grid dimension constants
+  dim = 128#512
+  shape = [dim] * 2
+
+  save_every = 20
+    
+  # Snapshotting parameters. Only needed for generating the simulation
+  # timelapse.
+  enable_snapshotting = True
+  my_dir = os.path.dirname(argv[0])
+  snapshot_dir = os.path.join(my_dir, 'sim_snaps')
+  snapshot_file_template = 'sim-%05d.png'
+  if enable_snapshotting:
+    try: os.mkdir(snapshot_dir)
+    except: pass
+
+  # Checkpointing parameters. The full state is saved periodically so long runs
+  # can be continued with `--resume` after being interrupted.
+  checkpoint_every = 200
+  checkpoint_path = os.path.join(my_dir, 'simulation_checkpoint.npz')
+
+  # Convergence parameters. When `convergence_tolerance` is set, the run stops
+  # once the mean terrain change per iteration stays below it for
+  # `convergence_patience` iterations. The per-iteration metrics are written
+  # to the report file either way.
+  convergence_tolerance = None #1e-5
+  convergence_patience = 10
+  report_path = os.path.join(my_dir, 'simulation_report.json')
+
+  # When set, the final fields are also written to a chunked multi-resolution
+  # store (see `chunkstore`), which loaders can read window by window.
+  store_path = None #os.path.join(my_dir, 'simulation_store')
+
+  if '--resume' in argv[1:]:
+    (kernel, start, calm_iterations) = ErosionKernel.from_checkpoint(
+        checkpoint_path)
+    dim = kernel.shape[0]
+    shape = [dim] * 2
+    print('Resuming from iteration %d' % start)
+  else:
+    # `terrain` represents the actual terrain height we're interested in. The
+    # kernel also tracks `sediment`, the amount of suspended "dirt" in the
+    # water, `water`, which is responsible for carrying sediment, and the water
+    # `velocity`. See `DEFAULT_PARAMS` for the physical constants.
+    kernel = ErosionKernel(util.fbm(shape, -2.0), DEFAULT_PARAMS)
+    start = 0
+    calm_iterations = 0
+
+  # The numer of iterations is proportional to the grid dimension. This is to 
+  # allow changes on one side of the grid to affect the other side.
+  iterations = int(1.4 * dim)
+  #iterations = 1000
+
+  # Snapshots are encoded and written in the background.
+  writer = None
+  if enable_snapshotting:
+    writer = SnapshotWriter(shape, snapshot_dir, snapshot_file_template)
+
+  report = run(kernel, iterations, start, writer, save_every,
+               checkpoint_path, checkpoint_every, convergence_tolerance,
+               'mean_delta', convergence_patience, calm_iterations)
+  with open(report_path, 'w') as report_file:
+    json.dump(report, report_file, indent=2, allow_nan=False)
+  if report['converged']:
+    print('Converged after %d of %d iterations' % (report['end'], iterations))
 
+  if writer is not None:
+    writer.close()
 
-  np.save('simulation', util.normalize(terrain))
+  np.save('simulation', util.normalize(kernel.terrain))
+  if store_path is not None:
+    chunkstore.write(store_path, {'height': util.normalize(kernel.terrain),
+                                  'sediment': kernel.sediment,
+                                  'water': kernel.water,
+                                  'velocity': kernel.velocity})
 
   
 if __name__ == '__main__':
-  main(sys.argv)
\ No newline at end of file
+  main(sys.argv)
@@ -1,78 +1,495 @@
 
+import ast
 import bpy
 import numpy as np
-from PIL import Image
 import os
-import tempfile
+import functools
+import zipfile
+import hashlib
+import json
 
-def load_npy_chunk(npy_dir, key="height", y_range=(0, 100), x_range=(0, 100)):
+def _mesh_from_buffers(name, co, vertex_index, loop_start, use_smooth=None):
+    """
+    Creates a mesh from flat buffers in the layout of Mesh.foreach_set, e.g. numpy
+    arrays or memory maps, with one bulk write per attribute.
+
+    Args:
+        name (str): Name of the new mesh datablock.
+        co (ndarray): Flat (N * 3) float32 vertex coordinates.
+        vertex_index (ndarray): Flat int32 vertex index of each loop.
+        loop_start (ndarray): int32 first loop of each polygon.
+        use_smooth (ndarray): Optional bool smooth flag of each polygon.
+
+    Returns:
+        mesh (bpy.types.Mesh): The new mesh.
+    """
+    n_faces = len(loop_start)
+
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(co) // 3)
+    mesh.vertices.foreach_set("co", co)
+
+    mesh.loops.add(len(vertex_index))
+    mesh.loops.foreach_set("vertex_index", vertex_index)
+
+    mesh.polygons.add(n_faces)
+    mesh.polygons.foreach_set("loop_start", loop_start)
+    # Blender 4.0+ derives polygon sizes from loop_start and made this read-only
+    if not mesh.polygons.bl_rna.properties["loop_total"].is_readonly:
+        loop_total = np.diff(np.append(loop_start, len(vertex_index))).astype(np.int32)
+        mesh.polygons.foreach_set("loop_total", loop_total)
+
+    if use_smooth is not None:
+        mesh.polygons.foreach_set("use_smooth", use_smooth)
+
+    mesh.update(calc_edges=True)
+    return mesh
+
+def _mesh_from_arrays(name, verts, faces, smooth=False):
+    """
+    Creates a mesh from numpy arrays with one bulk write per attribute.
+
+    Args:
+        name (str): Name of the new mesh datablock.
+        verts (ndarray): (N, 3) vertex coordinates.
+        faces (ndarray): (F, k) vertex indices, k corners per face.
+        smooth (bool): Whether to shade the faces smooth.
+
+    Returns:
+        mesh (bpy.types.Mesh): The new mesh.
+    """
+    n_faces, corners = faces.shape
+    return _mesh_from_buffers(
+        name,
+        np.ascontiguousarray(verts, dtype=np.float32).ravel(),
+        np.ascontiguousarray(faces, dtype=np.int32).ravel(),
+        np.arange(0, faces.size, corners, dtype=np.int32),
+        np.ones(n_faces, dtype=bool) if smooth else None,
+    )
+
+@functools.lru_cache(maxsize=4)
+def _grid_topology(n_rows, n_cols):
+    """
+    Returns the (x, -y) vertex positions and quad faces of an n_rows x n_cols grid,
+    in the vertex order of the terrain loaders. Cached per shape; the arrays are read-only.
+    """
+    index = np.arange(n_rows * n_cols, dtype=np.int32)
+    y, x = np.divmod(index, n_cols)
+    xy = np.column_stack([x, -y]).astype(np.float32)  # Flip Y for Blender convention
+
+    v1 = index.reshape(n_rows, n_cols)[:-1, :-1].ravel()
+    quads = np.column_stack([v1, v1 + 1, v1 + n_cols + 1, v1 + n_cols])
+
+    xy.setflags(write=False)
+    quads.setflags(write=False)
+    return xy, quads
+
+def _grid_mesh(name, height, smooth=True):
+    """
+    Creates a grid mesh with one vertex per heightmap cell at (x, -y, height[y, x])
+    and one quad per grid cell, without any per-vertex Python work.
+    """
+    xy, quads = _grid_topology(*height.shape)
+    verts = np.empty((len(xy), 3), dtype=np.float32)
+    verts[:, :2] = xy
+    verts[:, 2] = np.asarray(height).ravel()
+    return _mesh_from_arrays(name, verts, quads, smooth=smooth)
+
+
+def _npz_member_memmap(npz_path, key):
+    """
+    Memory-maps an array stored uncompressed in a .npz file (as written by np.savez),
+    by locating the .npy member inside the zip archive.
+
+    Args:
+        npz_path (str): Path to the .npz file.
+        key (str): Name of the array, e.g. "height" or "river".
+
+    Returns:
+        arr (ndarray): Read-only memory map of the array, or None if it cannot be
+            mapped, e.g. because the member is compressed (np.savez_compressed).
+            The reason is printed.
+    """
+    with zipfile.ZipFile(npz_path) as archive:
+        try:
+            info = archive.getinfo(key + ".npy")
+        except KeyError:
+            raise KeyError(f"The .npz file has no '{key}' array.")
+        if info.compress_type != zipfile.ZIP_STORED:
+            print(f"'{key}' is compressed in {npz_path} and cannot be memory-mapped.")
+            return None
+
+    with open(npz_path, "rb") as f:
+        # The local file header is 30 bytes plus the file name and extra field,
+        # whose lengths may differ from the central directory's
+        f.seek(info.header_offset + 26)
+        name_len, extra_len = np.frombuffer(f.read(4), dtype="<u2")
+        f.seek(info.header_offset + 30 + int(name_len) + int(extra_len))
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        elif version == (2, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        elif version == (3, 0):
+            # Like 2.0 but with a utf8 header, which numpy has no public reader for
+            header_len, = np.frombuffer(f.read(4), dtype="<u4")
+            header = ast.literal_eval(f.read(int(header_len)).decode("utf8"))
+            shape, fortran_order = header["shape"], header["fortran_order"]
+            dtype = np.lib.format.descr_to_dtype(header["descr"])
+        else:
+            print(f"'{key}' in {npz_path} has the unknown .npy format {version} "
+                  f"and cannot be memory-mapped.")
+            return None
+        offset = f.tell()
+
+    if dtype.hasobject:
+        print(f"'{key}' in {npz_path} holds Python objects and cannot be memory-mapped.")
+        return None
+    return np.memmap(npz_path, dtype=dtype, mode="r", shape=shape, offset=offset,
+                     order="F" if fortran_order else "C")
+
+def open_heightmap(path, key="height", level=0):
+    """
+    Opens a 2D array for windowed reading without loading it into memory.
+
+    Args:
+        path (str): A .npy file, a .npz file, a directory of .npy files (exported from .npz),
+            or a chunk store directory (see terrain/chunkstore.py).
+        key (str): Which array to open, e.g. "height" or "river" (ignored for .npy files).
+        level (int): Pyramid level to open from a chunk store, each halving the resolution.
+
+    Returns:
+        arr (ndarray): Read-only memory map of the array. .npz members that cannot
+            be mapped (e.g. compressed ones) are loaded in full instead. Chunk store
+            channels are returned as a ChannelView, which reads only the tiles
+            of the window it is sliced with.
+    """
+    import chunkstore
+
+    if os.path.isdir(path) and chunkstore.is_store(path):
+        return chunkstore.ChunkStore(path).view(key, level)
+    if level != 0:
+        raise ValueError("Pyramid levels are only available from chunk stores.")
+    if os.path.isdir(path):
+        path = os.path.join(path, f"{key}.npy")
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"Expected file not found: {path}")
+
+    if path.endswith(".npz"):
+        arr = _npz_member_memmap(path, key)
+        if arr is None:
+            print(f"Loading '{key}' from {path} in full instead.")
+            with np.load(path) as data:
+                arr = data[key]
+        return arr
+    return np.load(path, mmap_mode='r')
+
+def read_window(arr, y_range=None, x_range=None, stride=1, downsample=1):
+    """
+    Reads a window of a 2D array, optionally strided or downsampled.
+
+    Args:
+        arr (ndarray): 2D array, typically a memory map from open_heightmap.
+        y_range (tuple): (start_row, end_row) to read, or None for all rows.
+        x_range (tuple): (start_col, end_col) to read, or None for all columns.
+        stride (int): Keep every `stride`-th row and column. Stays a view of `arr`.
+        downsample (int): Average `downsample` x `downsample` blocks, after striding.
+            Trailing rows and columns that do not fill a block are dropped.
+
+    Returns:
+        window (ndarray): The window, a view of `arr` unless downsampled.
+    """
+    y_range = y_range or (0, arr.shape[0])
+    x_range = x_range or (0, arr.shape[1])
+    window = arr[y_range[0]:y_range[1]:stride, x_range[0]:x_range[1]:stride]
+
+    if downsample > 1:
+        rows = window.shape[0] // downsample * downsample
+        cols = window.shape[1] // downsample * downsample
+        window = window[:rows, :cols].reshape(
+            rows // downsample, downsample, cols // downsample, downsample
+        ).mean(axis=(1, 3), dtype=np.float32)
+    return window
+
+def load_npy_chunk(npy_dir, key="height", y_range=(0, 100), x_range=(0, 100), stride=1, downsample=1):
     """
     Loads a chunk from a .npy file stored in a directory (exported from .npz) using memory mapping.
 
     Args:
-        npy_dir (str): Path to the directory containing .npy files.
+        npy_dir (str): Path to the directory containing .npy files, or a .npy/.npz file.
         key (str): Which array to load, e.g. "height" or "river".
         y_range (tuple): (start_row, end_row) to load.
         x_range (tuple): (start_col, end_col) to load.
+        stride (int): Keep every `stride`-th row and column.
+        downsample (int): Average `downsample` x `downsample` blocks.
 
     Returns:
         chunk (ndarray): Sliced 2D array chunk.
     """
-    npy_path = os.path.join(npy_dir, f"{key}.npy")
-    if not os.path.isfile(npy_path):
-        raise FileNotFoundError(f"Expected file not found: {npy_path}")
-
-    arr = np.load(npy_path, mmap_mode='r')
-    chunk = arr[y_range[0]:y_range[1], x_range[0]:x_range[1]]
+    arr = open_heightmap(npy_dir, key=key)
+    chunk = read_window(arr, y_range, x_range, stride=stride, downsample=downsample)
     return chunk
 
+def _open_attribute(source, key, level=0, derived_rasters=None):
+    """
+    Opens array `key` of a terrain file for windowed reading, or else derived raster
+    `key` from `derived_rasters` (a derived.DerivedRasters, shared across keys so the
+    height is read and hashed once). Returns None if there is no such array.
+    """
+    try:
+        return open_heightmap(source, key=key, level=level)
+    except (KeyError, FileNotFoundError):
+        pass
+    if derived_rasters is not None and key in derived_rasters.keys():
+        return derived_rasters[key]
+    return None
+
 def load_npz_terrain_with_river_displace(npz_path, name="Terrain", scale_xy=0.1, scale_z=1.0,
-                                         displace_strength=100.0, use_uv=False,
-                                         chunk_range = [], npy_path = None):
+                                         displace_strength=100.0, use_uv=True,
+                                         chunk_range = [], npy_path = None,
+                                         stride=1, downsample=1, river_mode="bake",
+                                         attributes=("land_mask",), bands=None, level=0):
     """
     Loads a .npz terrain file with 'height' and optionally 'river', creates a mesh in Blender,
     and applies a displace modifier based on river intensity.
+
+    Arrays are memory-mapped, so only the window that is meshed is read from disk.
+
+    Args:
+        npz_path (str): Path to the .npz file, or to a chunk store directory.
+        chunk_range (list): Optional [x_start, x_end, y_start, y_end] window, in cells.
+        npy_path (str): Optional directory of .npy files (exported from .npz) or chunk
+            store to read instead.
+        stride (int): Mesh every `stride`-th row and column.
+        downsample (int): Mesh the mean of `downsample` x `downsample` blocks.
+        attributes (tuple): Arrays to store as vertex attributes, read from the same
+            window. Derived rasters ("slope", "aspect", "curvature", "flow") are
+            computed once and cached next to the file; missing arrays are skipped.
+        level (int): Chunk store pyramid level to read; chunk_range stays in full
+            resolution cells.
+
+    Other arguments are as in load_terrain_arrays. A chunk keeps its place in
+    the full terrain, and the object scale grows with the sampling step.
     """
     # Load data
-    if chunk_range: ### TODO this does not work
-        height = load_npy_chunk(
-            npy_path, 
-            key="height",
-            y_range=(chunk_range[2], chunk_range[3]), 
-            x_range=(chunk_range[0], chunk_range[1]),
-        )
-        river = None ### TODO
+    source = npy_path or npz_path
+    height_map = open_heightmap(source, key="height", level=level)
+    try:
+        river_map = open_heightmap(source, key="river", level=level)  # Optional
+    except (KeyError, FileNotFoundError):
+        river_map = None
+
+    if chunk_range:
+        x_range = (chunk_range[0] >> level, -(-chunk_range[1] >> level))
+        y_range = (chunk_range[2] >> level, -(-chunk_range[3] >> level))
     else:
-        data = np.load(npz_path)
-        if "height" not in data:
-            raise KeyError("The .npz file must contain a 'height' array.")
-
-        height = data["height"]
-        river = data.get("river")  # Optional
-
-    n_rows, n_cols = height.shape
-    verts = []
-    faces = []
-
-    # Create vertices
-    for y in range(n_rows):
-        for x in range(n_cols):
-            z = height[y, x]
-            verts.append((x, -y, z))  # Flip Y for Blender convention
-
-    # Create quad faces
-    for y in range(n_rows - 1):
-        for x in range(n_cols - 1):
-            v1 = y * n_cols + x
-            v2 = v1 + 1
-            v3 = v1 + n_cols + 1
-            v4 = v1 + n_cols
-            faces.append((v1, v2, v3, v4))
+        x_range = y_range = None
+
+    height = read_window(height_map, y_range, x_range, stride=stride, downsample=downsample)
+    river = None
+    if river_map is not None:
+        river = read_window(river_map, y_range, x_range, stride=stride, downsample=downsample)
+
+    # Derived rasters come from the cache of the full-resolution .npz file
+    derived_rasters = None
+    if npz_path and npz_path.endswith(".npz") and level == 0:
+        import derived
+
+        derived_rasters = derived.DerivedRasters(npz_path)
+
+    attribute_arrays = {}
+    for key in attributes:
+        attribute_map = _open_attribute(source, key, level=level,
+                                        derived_rasters=derived_rasters)
+        if attribute_map is not None:
+            attribute_arrays[key] = read_window(attribute_map, y_range, x_range,
+                                                stride=stride, downsample=downsample)
+
+    step = stride * downsample * 2 ** level
+    obj = load_terrain_arrays(height, river, name=name, scale_xy=scale_xy * step, scale_z=scale_z,
+                              displace_strength=displace_strength, use_uv=use_uv,
+                              river_mode=river_mode, attributes=attribute_arrays, bands=bands)
+    if chunk_range:
+        obj.location.x += x_range[0] * 2 ** level * scale_xy
+        obj.location.y -= y_range[0] * 2 ** level * scale_xy
+    return obj
 
-    # Create mesh and object
-    mesh = bpy.data.meshes.new(name + "Mesh")
-    mesh.from_pydata(verts, [], faces)
-    mesh.update()
+def _normalize_river(river):
+    """
+    Returns `river` rescaled to [0, 1] as float32 (all zeros if it is constant).
+    """
+    river = np.asarray(river, dtype=np.float32)
+    river_normalized = river - river.min()
+    if river_normalized.max() > 0:
+        river_normalized /= river_normalized.max()
+    return river_normalized
+
+def _grid_uv(mesh, n_rows, n_cols):
+    """
+    Adds (or refills) a UV map that puts each vertex of the grid mesh from _grid_mesh
+    on the center of its pixel in an n_cols x n_rows image, with image rows running
+    top to bottom like the heightmap.
+    """
+    xy, quads = _grid_topology(n_rows, n_cols)
+    uv = np.empty((len(xy), 2), dtype=np.float32)
+    uv[:, 0] = (xy[:, 0] + 0.5) / n_cols
+    uv[:, 1] = 1.0 + (xy[:, 1] - 0.5) / n_rows
+
+    uv_layer = mesh.uv_layers.get("UVMap") or mesh.uv_layers.new(name="UVMap")
+    uv_layer.data.foreach_set("uv", uv[quads.ravel()].ravel())
+
+def _river_texture(name, river_normalized):
+    """
+    Fills the river image of `name` from memory and returns its texture. The image
+    and texture are reused across calls, so reloading does not leak datablocks.
+
+    Args:
+        name (str): Name of the terrain object.
+        river_normalized (ndarray): 2D river intensity in [0, 1].
+
+    Returns:
+        tex (bpy.types.ImageTexture): The "<name>_RiverTex" texture.
+    """
+    n_rows, n_cols = river_normalized.shape
+
+    # Blender images start at the bottom row
+    pixels = np.ones((n_rows, n_cols, 4), dtype=np.float32)
+    pixels[:, :, :3] = river_normalized[::-1, :, None]
+    pixels = pixels.ravel()
+
+    image = bpy.data.images.get(name + "_River")
+    if image is not None and tuple(image.size) != (n_cols, n_rows):
+        bpy.data.images.remove(image)
+        image = None
+    if image is None:
+        image = bpy.data.images.new(name + "_River", width=n_cols, height=n_rows,
+                                    alpha=False, float_buffer=True)
+        image.colorspace_settings.name = "Non-Color"
+        changed = True
+    else:
+        # Skip re-embedding a reused image whose pixels are already packed
+        current = np.empty(len(pixels), dtype=np.float32)
+        image.pixels.foreach_get(current)
+        changed = image.packed_file is None or not np.array_equal(current, pixels)
+
+    if changed:
+        image.pixels.foreach_set(pixels)
+        image.update()
+        image.pack()
+
+    tex = bpy.data.textures.get(name + "_RiverTex")
+    if tex is None:
+        tex = bpy.data.textures.new(name + "_RiverTex", type='IMAGE')
+    tex.image = image
+    return tex
+
+def _apply_river_displace(obj, river_normalized, displace_strength, use_uv=True):
+    """
+    Drives a (reused) DISPLACE modifier on `obj` with the in-memory river image.
+
+    Args:
+        obj (bpy.types.Object): Grid terrain object from _grid_mesh.
+        river_normalized (ndarray): 2D river intensity in [0, 1], same shape as the grid.
+        displace_strength (float): Strength of the displace modifier.
+        use_uv (bool): Map the image with a grid UV map, so each pixel lands on its
+            vertex. Local coordinates run from 0 to the grid size and tile the image.
+    """
+    tex = _river_texture(obj.name, river_normalized)
+
+    disp_mod = obj.modifiers.get("RiverDisplace")
+    if disp_mod is None:
+        disp_mod = obj.modifiers.new("RiverDisplace", type='DISPLACE')
+    disp_mod.texture = tex
+    disp_mod.strength = displace_strength
+    disp_mod.mid_level = 0.0
+
+    # The UV map is filled from the grid topology, so it is as cheap as LOCAL
+    if use_uv:
+        _grid_uv(obj.data, *river_normalized.shape)
+        disp_mod.texture_coords = 'UV'
+        disp_mod.uv_layer = "UVMap"
+    else:
+        disp_mod.texture_coords = 'LOCAL'
+
+def add_vertex_attributes(mesh, attributes):
+    """
+    Writes per-vertex attributes that materials can read with an Attribute node,
+    one foreach_set per channel. Existing attributes of the same name are replaced.
+
+    Args:
+        mesh (bpy.types.Mesh): Mesh whose vertices match the arrays, e.g. from _grid_mesh.
+        attributes (dict): Attribute name -> array with one value per vertex (any shape,
+            e.g. the 2D grid). Integer arrays become INT attributes, all others
+            (including boolean masks) FLOAT.
+    """
+    n_verts = len(mesh.vertices)
+    for attr_name, values in attributes.items():
+        values = np.asarray(values)
+        if values.size != n_verts:
+            raise ValueError(f"Attribute '{attr_name}' has {values.size} values for {n_verts} vertices.")
+
+        if values.dtype.kind in "iu":
+            data_type, values = "INT", values.astype(np.int32)
+        else:
+            data_type, values = "FLOAT", values.astype(np.float32)
+
+        attr = mesh.attributes.get(attr_name)
+        if attr is not None and (attr.data_type != data_type or attr.domain != 'POINT'):
+            mesh.attributes.remove(attr)
+            attr = None
+        if attr is None:
+            attr = mesh.attributes.new(attr_name, data_type, 'POINT')
+        attr.data.foreach_set("value", values.ravel())
+
+def height_bands(height, bands):
+    """
+    Returns the band index of each height, i.e. how many of the ascending thresholds
+    in `bands` it reaches, as int32.
+    """
+    return np.digitize(height, bands).astype(np.int32)
+
+def load_terrain_arrays(height, river=None, name="Terrain", scale_xy=0.1, scale_z=1.0,
+                        displace_strength=100.0, use_uv=True, river_mode="bake",
+                        attributes=None, bands=None):
+    """
+    Creates a terrain mesh in Blender from in-memory arrays, and displaces it by river
+    intensity if `river` is given.
+
+    Args:
+        height (ndarray): 2D heightmap.
+        river (ndarray): Optional 2D river intensity, same shape as `height`.
+        name (str): Name of the Blender object.
+        scale_xy (float): Uniform scale factor for X and Y axes.
+        scale_z (float): Scale factor for height (Z-axis).
+        displace_strength (float): Displacement (in local Z units) of the strongest river.
+        use_uv (bool): Map the river texture with a grid UV map that spans the terrain
+            (river_mode "image" only). Local coordinates tile the image once per cell.
+        river_mode (str): "bake" adds the displacement to the vertex heights at load time;
+            "image" drives a DISPLACE modifier with an in-memory image.
+        attributes (dict): Optional name -> 2D array (same shape as `height`) to store as
+            vertex attributes, e.g. {"land_mask": ..., "slope": ...}. The normalized
+            river is stored as "river".
+        bands (list): Optional ascending height thresholds; the band index of each
+            vertex is stored as the "height_band" attribute.
+    """
+    if river_mode not in ("bake", "image"):
+        raise ValueError(f"Unknown river_mode {river_mode!r}, expected 'bake' or 'image'.")
+
+    attributes = dict(attributes or {})
+    if bands is not None:
+        attributes["height_band"] = height_bands(height, bands)
+
+    river_normalized = None
+    if river is not None:
+        river_normalized = _normalize_river(river)
+        attributes.setdefault("river", river_normalized)
+        if river_mode == "bake":
+            print("Baking river displacement into the heights...")
+            height = height + displace_strength * river_normalized
+
+    # Create mesh (smooth shaded) and object
+    mesh = _grid_mesh(name + "Mesh", height, smooth=True)
+    add_vertex_attributes(mesh, attributes)
 
     obj = bpy.data.objects.new(name, mesh)
     bpy.context.collection.objects.link(obj)
@@ -80,69 +497,358 @@ def load_npz_terrain_with_river_displace(npz_path, name="Terrain", scale_xy=0.1,
     # Apply object scale
     obj.scale = (scale_xy, scale_xy, scale_z)
 
-    # Smooth shading
-    for p in mesh.polygons:
-        p.use_smooth = True
-
     # Set object active and select it
     bpy.context.view_layer.objects.active = obj
     obj.select_set(True)
 
     # Displace modifier with river
-    if river is not None:
-        print("Applying river displace modifier...")
+    if river_normalized is not None and river_mode == "image":
+        _apply_river_displace(obj, river_normalized, displace_strength, use_uv=use_uv)
+        print(f"Displace modifier applied with strength={displace_strength} and coords={obj.modifiers['RiverDisplace'].texture_coords}")
+    elif river_normalized is None:
+        print("No 'river' array given — skipping river displacement.")
 
-        # Normalize river to 0–255
-        river_normalized = river - river.min()
-        if river_normalized.max() > 0:
-            river_normalized /= river_normalized.max()
-        river_img = (river_normalized * 255).astype(np.uint8)
+    return obj
 
-        # Save image to temp file
-        tmp_path = os.path.join(tempfile.gettempdir(), f"{name}_river.png")
-        Image.fromarray(river_img).save(tmp_path)
+def tile_bounds(n, num_tiles, stride=1):
+    """
+    Splits n grid points into num_tiles tiles that share their seam rows or columns.
 
-        # Load image as Blender texture
-        if os.path.exists(tmp_path):
-            image = bpy.data.images.load(tmp_path)
-        else:
-            raise FileNotFoundError(f"Image not saved at {tmp_path}")
+    Args:
+        n (int): Number of rows or columns of the full grid.
+        num_tiles (int): Number of tiles along this axis.
+        stride (int): Sampling step; bounds fall on multiples of it.
 
-        # Create texture datablock
-        tex = bpy.data.textures.new(name + "_RiverTex", type='IMAGE')
-        tex.image = image
+    Returns:
+        bounds (ndarray): num_tiles + 1 indices; tile k spans bounds[k] to bounds[k + 1] inclusive.
+    """
+    n_samples = (n - 1) // stride + 1
+    return np.linspace(0, n_samples - 1, num_tiles + 1).round().astype(int) * stride
 
-        # Create and configure displace modifier
-        disp_mod = obj.modifiers.new("RiverDisplace", type='DISPLACE')
-        disp_mod.texture = tex
-        disp_mod.strength = displace_strength
-        disp_mod.mid_level = 0.0
-
-        # Use LOCAL coordinates unless UV unwrap is requested
-        if use_uv:
-            # Create UV map via ops (only way in Blender)
-            bpy.ops.object.mode_set(mode='EDIT')
-            bpy.ops.mesh.select_all(action='SELECT')
-            bpy.ops.uv.smart_project()
-            bpy.ops.object.mode_set(mode='OBJECT')
-            disp_mod.texture_coords = 'UV'
-        else:
-            disp_mod.texture_coords = 'LOCAL'
+def _tile_span(bounds, start, end):
+    """
+    Returns the (first, last + 1) indices of the tiles overlapping cells start to end.
+    """
+    first = int(np.clip(np.searchsorted(bounds, start, side="right") - 1, 0, len(bounds) - 2))
+    last = int(np.clip(np.searchsorted(bounds, end, side="left"), first + 1, len(bounds) - 1))
+    return first, last
 
-        print(f"Displace modifier applied with strength={displace_strength} and coords={disp_mod.texture_coords}")
+def load_terrain_tiles(path, name="Terrain", tiles=(4, 4), scale_xy=0.1, scale_z=1.0,
+                       roi=None, margin=0, stride=1, smooth=True, reload=False, unload=False):
+    """
+    Loads a heightmap as a grid of tile objects under one empty parent, so that
+    edits, BVH builds and raycasts only touch the tiles they need. Neighbouring
+    tiles share their seam vertices. The heightmap is memory-mapped, and only
+    the windows of the tiles that are (re)built are read.
+
+    Calling it again with another region of interest adds the missing tiles.
+
+    Args:
+        path (str): A .npz or .npy file, or a directory of .npy files, with a 'height' array.
+        name (str): Name of the parent empty; tiles are named "<name>_<row>_<col>".
+        tiles (tuple): Number of tiles as (rows, cols).
+        scale_xy (float): Uniform scale factor for X and Y axes.
+        scale_z (float): Scale factor for height (Z-axis).
+        roi (list): Optional [x_start, x_end, y_start, y_end] region of interest, in cells.
+            Only the tiles overlapping it are loaded. Defaults to all tiles.
+        margin (int): Number of extra tiles to load around the region of interest.
+        stride (int): Mesh every `stride`-th row and column.
+        smooth (bool): Whether to apply smooth shading.
+        reload (bool): Rebuild tiles that already exist, e.g. after the heightmap changed.
+        unload (bool): Remove tiles outside the region of interest.
+
+    Returns:
+        parent (bpy.types.Object): The empty that carries the scale of the terrain;
+            move it to place all tiles.
+    """
+    height_map = open_heightmap(path, key="height")
+    row_bounds = tile_bounds(height_map.shape[0], tiles[0], stride)
+    col_bounds = tile_bounds(height_map.shape[1], tiles[1], stride)
+
+    # Tiles overlapping the region of interest, grown by the margin
+    if roi:
+        col_range = _tile_span(col_bounds, roi[0], roi[1])
+        row_range = _tile_span(row_bounds, roi[2], roi[3])
     else:
-        print("No 'river' array found in .npz file — skipping displace modifier.")
+        col_range, row_range = (0, tiles[1]), (0, tiles[0])
+    row_range = (max(row_range[0] - margin, 0), min(row_range[1] + margin, tiles[0]))
+    col_range = (max(col_range[0] - margin, 0), min(col_range[1] + margin, tiles[1]))
+
+    parent = bpy.data.objects.get(name)
+    if parent is None:
+        parent = bpy.data.objects.new(name, None)
+        bpy.context.collection.objects.link(parent)
+    parent.scale = (scale_xy, scale_xy, scale_z)
+
+    loaded = 0
+    for i in range(tiles[0]):
+        for j in range(tiles[1]):
+            tile_name = f"{name}_{i}_{j}"
+            obj = bpy.data.objects.get(tile_name)
+
+            if not (row_range[0] <= i < row_range[1] and col_range[0] <= j < col_range[1]):
+                if unload and obj is not None:
+                    mesh = obj.data
+                    bpy.data.objects.remove(obj)
+                    bpy.data.meshes.remove(mesh)
+                continue
+            if obj is not None and not reload:
+                continue
+
+            r0, r1 = row_bounds[i], row_bounds[i + 1]
+            c0, c1 = col_bounds[j], col_bounds[j + 1]
+            height = read_window(height_map, (r0, r1 + 1), (c0, c1 + 1), stride=stride)
+            mesh = _grid_mesh(tile_name + "Mesh", height, smooth=smooth)
+
+            if obj is None:
+                obj = bpy.data.objects.new(tile_name, mesh)
+                bpy.context.collection.objects.link(obj)
+                obj.parent = parent
+            else:
+                old_mesh = obj.data
+                obj.data = mesh
+                bpy.data.meshes.remove(old_mesh)
+
+            # Tile placement in the parent's (cell) coordinates
+            obj.location = (float(c0), -float(r0), 0.0)
+            obj.scale = (stride, stride, 1.0)
+            obj["tile"] = (i, j)
+            loaded += 1
+
+    print(f"Loaded {loaded} terrain tiles of '{name}' ({tiles[0]}x{tiles[1]} grid).")
+    return parent
+
+def load_terrain_lod(path, point, name="TerrainLOD", scale_xy=0.1, scale_z=1.0,
+                     leaf_cells=32, lod_distance=2.0, smooth=True):
+    """
+    Loads a heightmap as quadtree level-of-detail nodes (see terrain/lod.py) under one
+    empty parent. Nodes near `point` are meshed at full resolution, distant ones at
+    halving resolutions, and seams between levels are crack-free.
+
+    Calling it again with a new point replaces the previous nodes.
+
+    Args:
+        path (str): A .npz or .npy file, or a directory of .npy files, with a 'height' array.
+        point (tuple): Point of interest (x, y) in cells, i.e. (col, row) of the heightmap.
+        name (str): Name of the parent empty; nodes are named "<name>_<depth>_<row>_<col>".
+        scale_xy (float): Uniform scale factor for X and Y axes.
+        scale_z (float): Scale factor for height (Z-axis).
+        leaf_cells (int): Quads per node side; must be even.
+        lod_distance (float): Nodes closer than this many node sizes to `point` are split.
+        smooth (bool): Whether to apply smooth shading.
+
+    Returns:
+        parent (bpy.types.Object): The empty that carries the scale of the terrain.
+    """
+    import lod
+
+    height = open_heightmap(path, key="height")
+    nodes = lod.build_lod(height, point, leaf_cells=leaf_cells, lod_distance=lod_distance)
+
+    parent = bpy.data.objects.get(name)
+    if parent is None:
+        parent = bpy.data.objects.new(name, None)
+        bpy.context.collection.objects.link(parent)
+    parent.scale = (scale_xy, scale_xy, scale_z)
+
+    # Drop the nodes of the previous selection
+    for child in list(parent.children):
+        mesh = child.data
+        bpy.data.objects.remove(child)
+        if mesh is not None and mesh.users == 0:
+            bpy.data.meshes.remove(mesh)
+
+    for node in nodes:
+        row, col = node["origin"]
+        node_name = f"{name}_{node['depth']}_{row}_{col}"
+        # Nodes clipped to the heightmap have a shorter last step, so the vertices
+        # are placed at their sample positions instead of scaling a unit grid
+        rows, cols = node["rows"], node["cols"]
+        _, quads = _grid_topology(len(rows), len(cols))
+        verts = np.empty((len(rows) * len(cols), 3), dtype=np.float32)
+        verts[:, 0] = np.tile(cols, len(rows))
+        verts[:, 1] = -np.repeat(rows, len(cols))
+        verts[:, 2] = node["height"].ravel()
+        mesh = _mesh_from_arrays(node_name + "Mesh", verts, quads, smooth=smooth)
+        obj = bpy.data.objects.new(node_name, mesh)
+        bpy.context.collection.objects.link(obj)
+        obj.parent = parent
+
+    n_verts = sum(node["height"].size for node in nodes)
+    print(f"Loaded {len(nodes)} LOD nodes of '{name}' with {n_verts} vertices (full grid: {height.size}).")
+    return parent
+
+def load_terrain_tin(path, max_error, name="TerrainTIN", scale_xy=0.1, scale_z=1.0,
+                     water_level=None, smooth=True):
+    """
+    Loads a heightmap as an adaptive triangle mesh (see terrain/tin.py), with large
+    triangles in flat areas and full resolution only where the terrain needs it.
+
+    Args:
+        path (str): A .npz or .npy file, or a directory of .npy files, with a 'height' array.
+        max_error (float): Maximum vertical error, in heightmap units.
+        name (str): Name of the Blender object.
+        scale_xy (float): Uniform scale factor for X and Y axes.
+        scale_z (float): Scale factor for height (Z-axis).
+        water_level (float): Optional height, in heightmap units, below which
+            fully submerged triangles are dropped.
+        smooth (bool): Whether to apply smooth shading.
+
+    Returns:
+        obj (bpy.types.Object): The terrain object.
+    """
+    import tin
+
+    height = open_heightmap(path, key="height")
+    result = tin.triangulate(height, max_error, water_level=water_level)
+
+    points = result["points"]
+    verts = np.empty((len(points), 3), dtype=np.float32)
+    verts[:, 0] = points[:, 1]
+    verts[:, 1] = -points[:, 0]  # Flip Y for Blender convention
+    verts[:, 2] = result["height"]
+    mesh = _mesh_from_arrays(name + "Mesh", verts, result["triangles"], smooth=smooth)
+
+    obj = bpy.data.objects.new(name, mesh)
+    bpy.context.collection.objects.link(obj)
+    obj.scale = (scale_xy, scale_xy, scale_z)
+
+    print(f"Loaded TIN terrain '{name}' with {len(result['triangles'])} triangles "
+          f"(full grid: {2 * (height.shape[0] - 1) * (height.shape[1] - 1)}).")
+    return obj
+
+MESH_BUFFERS = ("co", "vertex_index", "loop_start", "use_smooth")
+
+def file_hash(path):
+    """
+    Returns a hex digest of the contents of the file at `path`.
+    """
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def save_mesh_cache(obj, cache_dir):
+    """
+    Writes the mesh of `obj` and its transform to `cache_dir` as .npy buffers that
+    load_mesh_cache can memory-map and upload without any per-element Python work.
+
+    Args:
+        obj (bpy.types.Object): Mesh object to cache.
+        cache_dir (str): Directory for this cache entry.
+    """
+    import atomic
+
+    mesh = obj.data
+    buffers = {
+        "co": np.empty(len(mesh.vertices) * 3, dtype=np.float32),
+        "vertex_index": np.empty(len(mesh.loops), dtype=np.int32),
+        "loop_start": np.empty(len(mesh.polygons), dtype=np.int32),
+        "use_smooth": np.empty(len(mesh.polygons), dtype=bool),
+    }
+    mesh.vertices.foreach_get("co", buffers["co"])
+    mesh.loops.foreach_get("vertex_index", buffers["vertex_index"])
+    mesh.polygons.foreach_get("loop_start", buffers["loop_start"])
+    mesh.polygons.foreach_get("use_smooth", buffers["use_smooth"])
+
+    # Vertex attributes, e.g. from add_vertex_attributes
+    attributes = [attr.name for attr in mesh.attributes
+                  if attr.domain == 'POINT' and attr.data_type in ("FLOAT", "INT")
+                  and not attr.name.startswith(".")]
+    for attr_name in attributes:
+        attr = mesh.attributes[attr_name]
+        values = np.empty(len(mesh.vertices), dtype=np.float32 if attr.data_type == "FLOAT" else np.int32)
+        attr.data.foreach_get("value", values)
+        buffers["attr_" + attr_name] = values
+
+    meta = {
+        "attributes": attributes,
+        "location": list(obj.location),
+        "rotation_euler": list(obj.rotation_euler),
+        "scale": list(obj.scale),
+    }
+    with atomic.cache_write(os.path.join(cache_dir, "meta.json"), meta):
+        for key, buffer in buffers.items():
+            atomic.save_npy(os.path.join(cache_dir, key + ".npy"), buffer)
+
+def load_mesh_cache(cache_dir, name="Terrain"):
+    """
+    Rebuilds an object saved with save_mesh_cache.
+
+    Args:
+        cache_dir (str): Directory of the cache entry.
+        name (str): Name of the Blender object.
+
+    Returns:
+        obj (bpy.types.Object): The object, or None if the entry is missing or incomplete.
+    """
+    try:
+        with open(os.path.join(cache_dir, "meta.json")) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    buffers = {key: np.load(os.path.join(cache_dir, key + ".npy"), mmap_mode='r')
+               for key in MESH_BUFFERS}
+    mesh = _mesh_from_buffers(name + "Mesh", **buffers)
+    add_vertex_attributes(mesh, {
+        attr_name: np.load(os.path.join(cache_dir, "attr_" + attr_name + ".npy"), mmap_mode='r')
+        for attr_name in meta.get("attributes", [])
+    })
 
+    obj = bpy.data.objects.new(name, mesh)
+    bpy.context.collection.objects.link(obj)
+    obj.location = meta["location"]
+    obj.rotation_euler = meta["rotation_euler"]
+    obj.scale = meta["scale"]
     return obj
 
+def load_cached_terrain(npz_path, build, name="Terrain", cache_root=None, source_hash=None,
+                        **params):
+    """
+    Loads a terrain object from the mesh cache, building and caching it on a miss.
+    Entries are keyed by the contents of `npz_path`, the builder and `params`, so
+    changing the file or any loader parameter (scale, chunk window, stride, LOD,
+    erosion, ...) builds a new entry.
+
+    Args:
+        npz_path (str): Path to the source .npz file.
+        build (callable): build(npz_path, name=name, **params) -> object, e.g.
+            load_npz_terrain_with_river_displace or load_terrain_tin. Its modifiers
+            are not cached, so bake river displacement into the mesh.
+        name (str): Name of the Blender object.
+        cache_root (str): Cache directory; defaults to "<npz name>_meshcache" next to the file.
+        source_hash (str): Identifies the source data instead of hashing `npz_path`, e.g.
+            when the terrain is already in memory. Defaults to the hash of the file.
+        **params: Loader parameters, passed on to `build`. Must be JSON-serializable.
+
+    Returns:
+        obj (bpy.types.Object): The terrain object.
+    """
+    cache_root = cache_root or os.path.splitext(npz_path)[0] + "_meshcache"
+    source_hash = source_hash or file_hash(npz_path)
+    key = hashlib.sha1(json.dumps(
+        [source_hash, build.__module__, build.__qualname__, params], sort_keys=True
+    ).encode()).hexdigest()
+    cache_dir = os.path.join(cache_root, key)
+
+    obj = load_mesh_cache(cache_dir, name=name)
+    if obj is not None:
+        print(f"Loaded terrain mesh '{name}' from cache {cache_dir}.")
+        return obj
+
+    obj = build(npz_path, name=name, **params)
+    if obj.modifiers:
+        print(f"Warning: modifiers of '{name}' are not cached.")
+    save_mesh_cache(obj, cache_dir)
+    print(f"Cached terrain mesh '{name}' in {cache_dir}.")
+    return obj
 
 
 
 import bpy
 import numpy as np
-from PIL import Image
-import os
-import tempfile
 
 def load_npz_terrain_with_river_displace_1(npz_path, name="Terrain", scale_xy=0.1, scale_z=1.0,
                                          displace_strength=0.5, smooth=True):
@@ -158,81 +864,19 @@ def load_npz_terrain_with_river_displace_1(npz_path, name="Terrain", scale_xy=0.
     height = data["height"]
     river = data.get("river")  # Optional
 
-    n_rows, n_cols = height.shape
-    verts = []
-    faces = []
-
-    # Create vertices
-    for y in range(n_rows):
-        for x in range(n_cols):
-            z = height[y, x]
-            verts.append((x, -y, z))  # Flip Y for Blender convention
-
-    # Create quad faces
-    for y in range(n_rows - 1):
-        for x in range(n_cols - 1):
-            v1 = y * n_cols + x
-            v2 = v1 + 1
-            v3 = v1 + n_cols + 1
-            v4 = v1 + n_cols
-            faces.append((v1, v2, v3, v4))
-
     # Create mesh and object
-    mesh = bpy.data.meshes.new(name + "Mesh")
-    mesh.from_pydata(verts, [], faces)
-    mesh.update()
+    mesh = _grid_mesh(name + "Mesh", height, smooth=smooth)
 
     obj = bpy.data.objects.new(name, mesh)
     bpy.context.collection.objects.link(obj)
 
     obj.scale = (scale_xy, scale_xy, scale_z)
-    if smooth:
-        bpy.context.view_layer.objects.active = obj
-        bpy.ops.object.shade_smooth()
 
-    # Add displace modifier using river data
+    # Add displace modifier using river data (filled in memory, reused on reload)
     if river is not None:
         print("Applying river displace modifier...")
-
-        # Normalize river array to 0-255
-        river_normalized = river.copy()
-        river_normalized -= river_normalized.min()
-        if river_normalized.max() > 0:
-            river_normalized /= river_normalized.max()
-        river_img = (river_normalized * 255).astype(np.uint8)
-
-        # Save temporary grayscale image
-        tmp_dir = tempfile.gettempdir()
-        img_path = os.path.join(tmp_dir, f"{name}_river.png")
-        Image.fromarray(river_img).save(img_path)
-
-        # Load image into Blender
-        img = bpy.data.images.load(img_path)
-
-        # Create texture
-        tex = bpy.data.textures.new(name + "_RiverTex", type='IMAGE')
-        tex.image = img
-
-        # Ensure object is active and selected before applying any modifier
-        bpy.ops.object.select_all(action='DESELECT')
-        bpy.context.view_layer.objects.active = obj
-        obj.select_set(True)
-        
-        # Add displace modifier
-        disp_mod = obj.modifiers.new("RiverDisplace", type='DISPLACE')
-        disp_mod.texture = tex
-        disp_mod.texture_coords = 'LOCAL'
-
-        disp_mod.strength = displace_strength
-        
-        # Add UV map (if not present)
-        if not obj.data.uv_layers:
-            bpy.ops.object.mode_set(mode='EDIT')
-            bpy.ops.mesh.select_all(action='SELECT')
-            bpy.ops.uv.smart_project()
-            bpy.ops.object.mode_set(mode='OBJECT')
-
-        print(f"Displace modifier applied with texture: {img_path}")
+        _apply_river_displace(obj, _normalize_river(river), displace_strength)
+        print(f"Displace modifier applied with texture: {name}_River")
 
     return obj
 
@@ -258,39 +902,103 @@ def load_npz_terrain(npz_path, name="Terrain", scale_xy=0.1, scale_z=1.0, smooth
         raise KeyError("The .npz file must contain a 'height' array.")
     
     height = data["height"]
-    n_rows, n_cols = height.shape
-    verts = []
-    faces = []
-
-    # Create vertices
-    for y in range(n_rows):
-        for x in range(n_cols):
-            z = height[y, x]
-            verts.append((x, -y, z))  # Invert Y for Blender-style orientation
-
-    # Create quad faces
-    for y in range(n_rows - 1):
-        for x in range(n_cols - 1):
-            v1 = y * n_cols + x
-            v2 = v1 + 1
-            v3 = v1 + n_cols + 1
-            v4 = v1 + n_cols
-            faces.append((v1, v2, v3, v4))
-
-    # Create Blender mesh
-    mesh = bpy.data.meshes.new(name + "Mesh")
-    mesh.from_pydata(verts, [], faces)
-    mesh.update()
+
+    # Create Blender mesh (smooth shading is set per polygon in bulk)
+    mesh = _grid_mesh(name + "Mesh", height, smooth=smooth)
 
     obj = bpy.data.objects.new(name, mesh)
     bpy.context.collection.objects.link(obj)
 
-    # Scale and smooth
+    # Scale
     obj.scale = (scale_xy, scale_xy, scale_z)
-    if smooth:
-        bpy.context.view_layer.objects.active = obj
-        bpy.ops.object.shade_smooth()
 
     print(f"Loaded terrain mesh '{name}' with shape {height.shape}.")
 
-    return obj
\ No newline at end of file
+    return obj
+
+
+def load_river_ribbons(npz_path, name="Rivers", scale_xy=0.1, scale_z=1.0,
+                       width_scale=0.25, width_exponent=0.5, min_volume=None,
+                       volume_quantile=0.9, z_offset=0.0):
+    """
+    Loads the river graph exported by river_network and builds the whole network
+    as a single connected water ribbon mesh, one quad per river segment, with
+    the segments meeting at a river point sharing its two vertices.
+
+    Args:
+        npz_path (str): Path to the .npz file written by river_network.main.
+        name (str): Name of the Blender object.
+        scale_xy (float): Uniform scale factor for X and Y axes (match the terrain).
+        scale_z (float): Scale factor for height (match the terrain).
+        width_scale (float): Ribbon width, in grid cells, for a volume of 1.
+        width_exponent (float): Width grows with volume ** width_exponent.
+        min_volume (float): Segments starting below this volume are skipped. Defaults to
+            the `volume_quantile` of the segment volumes, since every land point drains
+            somewhere and most of them carry little more than their own rain.
+        volume_quantile (float): Fraction of the segments, by volume, that are skipped
+            when `min_volume` is None, e.g. 0.9 keeps the largest 10%.
+        z_offset (float): Height added to the ribbon, in unscaled height units.
+
+    Returns:
+        obj (bpy.types.Object): The ribbon object.
+    """
+    with np.load(npz_path) as data:
+        if "river_downstream" not in data:
+            raise KeyError("The .npz file must contain the river graph arrays.")
+
+        points = data["river_points"]
+        downstream = data["river_downstream"]
+        volume = data["river_volume"]
+        river_height = data["river_height"]
+
+    # One segment from every point to its downstream point. Volume only grows
+    # downstream, so the kept segments form connected rivers
+    has_downstream = downstream >= 0
+    if min_volume is None:
+        min_volume = np.quantile(volume[has_downstream], volume_quantile) if has_downstream.any() else 0.0
+    src = np.flatnonzero(has_downstream & (volume >= min_volume))
+    dst = downstream[src]
+
+    # Points are (row, col); flip Y for Blender convention like the terrain loaders
+    xy = np.column_stack([points[:, 1], -points[:, 0]])
+    direction = xy[dst] - xy[src]
+    length = np.linalg.norm(direction, axis=1)
+    keep = length > 0
+    src, dst, direction, length = src[keep], dst[keep], direction[keep], length[keep]
+
+    # Per-point half width, so ribbons widen as tributaries join
+    half_width = 0.5 * width_scale * np.power(volume, width_exponent)
+    normal = np.column_stack([-direction[:, 1], direction[:, 0]]) / length[:, None]
+
+    # Two vertices per river point, shared by the segments ending and starting
+    # there, so bends and confluences stay connected. They are offset along the
+    # average normal of those segments, or a single one where they cancel
+    used, ends = np.unique(np.concatenate([src, dst]), return_inverse=True)
+    src_index, dst_index = ends[:len(src)], ends[len(src):]
+    point_normal = np.zeros((len(used), 2))
+    np.add.at(point_normal, src_index, normal)
+    np.add.at(point_normal, dst_index, normal)
+    fallback = np.empty_like(point_normal)
+    fallback[dst_index] = normal
+    fallback[src_index] = normal
+    norm = np.linalg.norm(point_normal, axis=1, keepdims=True)
+    point_normal = np.where(norm > 1e-6, point_normal / np.maximum(norm, 1e-6), fallback)
+    offset = point_normal * half_width[used, None]
+
+    verts = np.empty((len(used), 2, 3), dtype=np.float32)
+    verts[:, 0, :2] = xy[used] - offset
+    verts[:, 1, :2] = xy[used] + offset
+    verts[:, :, 2] = (river_height[used] + z_offset)[:, None]
+
+    n_segments = len(src)
+    faces = np.column_stack([2 * src_index, 2 * dst_index,
+                             2 * dst_index + 1, 2 * src_index + 1]).astype(np.int32)
+
+    mesh = _mesh_from_arrays(name + "Mesh", verts.reshape(-1, 3), faces)
+    obj = bpy.data.objects.new(name, mesh)
+    bpy.context.collection.objects.link(obj)
+    obj.scale = (scale_xy, scale_xy, scale_z)
+
+    print(f"Loaded river ribbons '{name}' with {n_segments} segments.")
+
+    return obj
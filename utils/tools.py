@@ -4,7 +4,9 @@ import math
 import mathutils
 import bmesh
 from mathutils.bvhtree import BVHTree
+from mathutils.kdtree import KDTree
 import random
+import numpy as np
 
 import tqdm
 
@@ -224,13 +226,36 @@ def delete_all_except(exceptions):
     return
 
 
+def _world_edge_endpoints(obj):
+    """Return the world-space endpoints (E, 2, 3) and vertex indices (E, 2) of all edges of a mesh object."""
+    mesh = obj.data
+    co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", co)
+    edge_verts = np.empty(len(mesh.edges) * 2, dtype=np.int32)
+    mesh.edges.foreach_get("vertices", edge_verts)
+    edge_verts = edge_verts.reshape(-1, 2)
+
+    matrix = np.array(obj.matrix_world, dtype=np.float64)
+    co_world = co.reshape(-1, 3) @ matrix[:3, :3].T + matrix[:3, 3]
+    return co_world[edge_verts], edge_verts
+
+
+def _world_bounds(obj):
+    """Return the (min, max) corners of the world-space bounding box of an object."""
+    matrix = np.array(obj.matrix_world, dtype=np.float64)
+    corners = np.array(obj.bound_box, dtype=np.float64) @ matrix[:3, :3].T + matrix[:3, 3]
+    return corners.min(axis=0), corners.max(axis=0)
+
+
 def select_n_intersecting_edges(source_obj, target_obj, n=None):
     if source_obj.type != 'MESH' or target_obj.type != 'MESH':
         print("Both objects must be meshes.")
         return []
 
+    # Work on the mesh data in object mode
+    bpy.ops.object.mode_set(mode='OBJECT')
+
     depsgraph = bpy.context.evaluated_depsgraph_get()
-    source_eval = source_obj.evaluated_get(depsgraph)
     target_eval = target_obj.evaluated_get(depsgraph)
 
     target_bvh = BVHTree.FromObject(target_eval, depsgraph)
@@ -238,38 +263,30 @@ def select_n_intersecting_edges(source_obj, target_obj, n=None):
         print("Could not build BVH tree from target object.")
         return []
 
-    # Prepare source mesh for editing
-    bpy.ops.object.mode_set(mode='OBJECT')
-    for obj in bpy.context.selected_objects:
-        obj.select_set(False)
-    source_obj.select_set(True)
-    bpy.context.view_layer.objects.active = source_obj
-    bpy.ops.object.mode_set(mode='EDIT')
+    # All edges at once, in world space
+    endpoints, edge_verts = _world_edge_endpoints(source_obj)
+    v1_world, v2_world = endpoints[:, 0], endpoints[:, 1]
+
+    # Only edges whose bounding box overlaps the target's can intersect it
+    low, high = _world_bounds(target_eval)
+    eps = 1e-6
+    candidates = np.flatnonzero(
+        np.all(np.minimum(v1_world, v2_world) <= high + eps, axis=1)
+        & np.all(np.maximum(v1_world, v2_world) >= low - eps, axis=1)
+        & np.any(v1_world != v2_world, axis=1)
+    )
 
-    bm = bmesh.from_edit_mesh(source_obj.data)
-    bm.verts.ensure_lookup_table()
-    bm.edges.ensure_lookup_table()
-    source_matrix = source_obj.matrix_world
-
-    # Find all intersecting edges and store their midpoints
-    intersecting_edges = []
-    edge_midpoints = {}
-
-    for edge in bm.edges:
-        v1_world = source_matrix @ edge.verts[0].co
-        v2_world = source_matrix @ edge.verts[1].co
-        direction = v2_world - v1_world
-        length = direction.length
-        if length == 0:
-            continue
-        direction.normalize()
-
-        hit = target_bvh.ray_cast(v1_world, direction, length)
-        if hit[0] is not None:
-            intersecting_edges.append(edge)
-            edge_midpoints[edge] = (v1_world + v2_world) / 2
-
-    if not intersecting_edges:
+    # Find all intersecting edges among the candidates
+    direction = v2_world[candidates] - v1_world[candidates]
+    length = np.linalg.norm(direction, axis=1)
+    direction /= length[:, None]
+    hits = [
+        target_bvh.ray_cast(mathutils.Vector(origin), mathutils.Vector(d), l)[0] is not None
+        for origin, d, l in zip(v1_world[candidates].tolist(), direction.tolist(), length.tolist())
+    ]
+    intersecting_edges = candidates[np.array(hits, dtype=bool)]
+
+    if len(intersecting_edges) == 0:
         print("No intersecting edges found.")
         return []
 
@@ -277,31 +294,35 @@ def select_n_intersecting_edges(source_obj, target_obj, n=None):
     if n is None or n >= len(intersecting_edges):
         selected = intersecting_edges
     else:
-        # Start with a random edge
-        selected = [random.choice(intersecting_edges)]
-        remaining = set(intersecting_edges) - set(selected)
-
-        while len(selected) < n and remaining:
-            last_mid = edge_midpoints[selected[-1]]
-            # Sort remaining by distance to last selected midpoint
-            next_edge = min(remaining, key=lambda e: (edge_midpoints[e] - last_mid).length)
-            selected.append(next_edge)
-            remaining.remove(next_edge)
+        # Chain from a random edge to the nearest remaining edge midpoint each step
+        edge_midpoints = (v1_world[intersecting_edges] + v2_world[intersecting_edges]) / 2
+        kd = KDTree(len(edge_midpoints))
+        for i, mid in enumerate(edge_midpoints.tolist()):
+            kd.insert(mid, i)
+        kd.balance()
+
+        current = random.randrange(len(edge_midpoints))
+        chain = [current]
+        chosen = {current}
+        while len(chain) < n:
+            _, current, _ = kd.find(edge_midpoints[current].tolist(), filter=lambda i: i not in chosen)
+            chain.append(current)
+            chosen.add(current)
+        selected = np.sort(intersecting_edges[chain])
 
     # Deselect everything and highlight selected edges
-    for e in bm.edges:
-        e.select = False
-    ### TODO: would have liked this to be a separate function
-    #total_midpoint = mathutils.Vector((0, 0, 0))
-    for e in selected:
-        e.select = True
-        #total_midpoint += edge_midpoints[e]
-    #average_midpoint = total_midpoint / len(selected)
-    
-    bmesh.update_edit_mesh(source_obj.data, loop_triangles=False, destructive=False)
-    
-    edge_pairs = get_selected_edge_vertex_pairs(source_eval)
-    
+    edge_select = np.zeros(len(edge_verts), dtype=bool)
+    edge_select[selected] = True
+    _set_edge_selection(source_obj.data, edge_select, edge_verts)
+
+    for obj in bpy.context.selected_objects:
+        obj.select_set(False)
+    source_obj.select_set(True)
+    bpy.context.view_layer.objects.active = source_obj
+    bpy.ops.object.mode_set(mode='EDIT')
+
+    edge_pairs = [tuple(pair) for pair in np.sort(edge_verts[selected], axis=1).tolist()]
+
     return edge_pairs
 
 
@@ -336,47 +357,62 @@ def deselect_all_and_object_mode():
     # Deselect all objects
     bpy.ops.object.select_all(action='DESELECT')
 
-def get_selected_edge_vertex_pairs(obj):
-    """Return selected edges from the given object as sorted vertex index pairs."""
-    original_mode = obj.mode
-    if original_mode != 'EDIT':
-        bpy.ops.object.mode_set(mode='EDIT')
+def _pair_keys(pairs):
+    """Return one int64 key per sorted vertex index pair (K, 2); distinct for indices in [0, 2**31)."""
+    pairs = pairs.astype(np.int64)
+    return (pairs[:, 0] << 32) | pairs[:, 1]
 
-    bm = bmesh.from_edit_mesh(obj.data)
-    edge_pairs = []
 
-    for e in bm.edges:
-        if e.select:
-            v1, v2 = e.verts[0].index, e.verts[1].index
-            edge_pairs.append(tuple(sorted((v1, v2))))
+def _edge_vertex_keys(mesh):
+    """Return the vertex index pairs (E, 2), sorted per edge, and one int64 key per edge."""
+    edge_verts = np.empty(len(mesh.edges) * 2, dtype=np.int32)
+    mesh.edges.foreach_get("vertices", edge_verts)
+    edge_verts = np.sort(edge_verts.reshape(-1, 2), axis=1)
+    return edge_verts, _pair_keys(edge_verts)
 
-    # Restore mode if we changed it
-    if original_mode != 'EDIT':
-        bpy.ops.object.mode_set(mode=original_mode)
 
-    return edge_pairs
+def _set_edge_selection(mesh, edge_select, edge_verts):
+    """Select exactly the masked edges and their vertices of a mesh (in object mode), deselecting all faces."""
+    vert_select = np.zeros(len(mesh.vertices), dtype=bool)
+    vert_select[edge_verts[edge_select].ravel()] = True
+    mesh.polygons.foreach_set("select", np.zeros(len(mesh.polygons), dtype=bool))
+    mesh.edges.foreach_set("select", edge_select)
+    mesh.vertices.foreach_set("select", vert_select)
+    mesh.update()
+
+
+def get_selected_edge_vertex_pairs(obj):
+    """Return selected edges from the given object as sorted vertex index pairs."""
+    # Edit-mode changes only reach the mesh data when synced
+    if obj.mode == 'EDIT':
+        obj.update_from_editmode()
+
+    mesh = obj.data
+    select = np.empty(len(mesh.edges), dtype=bool)
+    mesh.edges.foreach_get("select", select)
+    edge_verts, _ = _edge_vertex_keys(mesh)
+
+    return [tuple(pair) for pair in edge_verts[select].tolist()]
 
 
 def select_edges_by_vertex_pairs(obj, edge_pairs):
     """Select edges on the given object that match the sorted vertex index pairs."""
+    # The edit mesh would overwrite the mesh data, so write it in object mode
     original_mode = obj.mode
-    if original_mode != 'EDIT':
-        bpy.ops.object.mode_set(mode='EDIT')
-
-    bm = bmesh.from_edit_mesh(obj.data)
-
-    for e in bm.edges:
-        e.select = False
+    if original_mode == 'EDIT':
+        bpy.ops.object.mode_set(mode='OBJECT')
 
-    for e in bm.edges:
-        v1, v2 = e.verts[0].index, e.verts[1].index
-        if tuple(sorted((v1, v2))) in edge_pairs:
-            e.select = True
+    mesh = obj.data
+    edge_verts, keys = _edge_vertex_keys(mesh)
+    pairs = np.sort(np.asarray(edge_pairs, dtype=np.int64).reshape(-1, 2), axis=1)
+    # Pairs from a mesh with more vertices cannot match any edge here
+    pairs = pairs[(pairs[:, 0] >= 0) & (pairs[:, 1] < len(mesh.vertices))]
+    edge_select = np.isin(keys, _pair_keys(pairs))
 
-    bmesh.update_edit_mesh(obj.data, False)
+    _set_edge_selection(mesh, edge_select, edge_verts)
 
     # Restore mode if we changed it
-    if original_mode != 'EDIT':
+    if original_mode == 'EDIT':
         bpy.ops.object.mode_set(mode=original_mode)
 
 def vec_deg2rad(rotation_degrees):